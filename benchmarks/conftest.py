@@ -0,0 +1,22 @@
+import functools
+
+import numpy as np
+import pytest
+
+LENGTHS = [300, 2190, 10000, 100000]
+"długości serii: od danych decyzyjnych (300 dni) do długich serii godzinowych"
+WINDOWS = [(10, 100), (20, 200), (30, 300), (5, 50)]
+
+
+@functools.lru_cache(maxsize=None)
+def make_series(length: int, seed: int = 0) -> np.ndarray:
+    "błądzenie losowe cen zamknięcia, takie samo przy każdym wywołaniu"
+    rng = np.random.default_rng(seed)
+    series = np.abs(1000 + np.cumsum(rng.normal(0, 10, length))) + 1
+    series.setflags(write=False)
+    return series
+
+
+@pytest.fixture(params=LENGTHS, ids=lambda length: f'n{length}')
+def records(request) -> np.ndarray:
+    return make_series(request.param)
@@ -0,0 +1,494 @@
+"""
+End-to-end benchmark harness.
+
+Measures cost function throughput, genetic algorithm time per generation, history serving
+latency, decision latency and websocket round trip with many concurrent clients.
+Agents run in one process without an XMPP server (messages go through spade's container)
+and CryptoCompare is replaced by a local stub server, so results do not depend on network.
+Results are written as JSON, to be compared between versions.
+
+    python -m benchmarks.harness --output results.json
+    python -m benchmarks.harness --only cost ga --quick
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import zlib
+
+import numpy as np
+from aiohttp import web
+
+import config
+
+SECTIONS = ('cost', 'ga', 'history', 'decision', 'websocket')
+DAY = 86400
+CURRENCIES = ('BTC', 'ETH', 'LTC', 'XRP', 'EOS', 'BCH', 'XLM', 'TRX')
+
+
+def summary(latencies) -> dict:
+    "percentyle opóźnień w milisekundach"
+    values = np.asarray(latencies, dtype=np.float64) * 1000
+    if not len(values):
+        return dict(count=0)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return dict(count=int(len(values)), mean_ms=float(values.mean()), p50_ms=float(p50), p90_ms=float(p90),
+                p99_ms=float(p99), max_ms=float(values.max()))
+
+
+def random_walk(seed: int, n: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.abs(1000 + np.cumsum(rng.normal(0, 10, n))) + 1
+
+
+#
+# Zaślepka CryptoCompare
+#
+class StubCryptoCompare:
+    """
+    Local HTTP server answering /data/v2/histoday, /data/price and /data/pricemulti
+    like CryptoCompare, with deterministic prices (random walk seeded by symbol).
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.requests = 0
+        self.peers = set()  # adresy klientów - jedno połączenie keep-alive to jeden adres
+        self.runner = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/data/v2/histoday', self.histoday)
+        app.router.add_get('/data/price', self.price)
+        app.router.add_get('/data/pricemulti', self.pricemulti)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def _answer(self, request, data):
+        self.requests += 1
+        self.peers.add(request.transport.get_extra_info('peername'))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response(data)
+
+    @staticmethod
+    def _close(fsym: str, day: int) -> float:
+        "cena zamknięcia symbolu w danym dniu (od 2014 roku)"
+        first = 1388534400 // DAY
+        walk = random_walk(zlib.crc32(fsym.encode()), max(day - first + 1, 1))
+        return float(walk[-1])
+
+    async def histoday(self, request):
+        fsym = request.query['fsym']
+        limit = int(request.query.get('limit', 30))
+        last = int(request.query.get('toTs', time.time())) // DAY
+        first = 1388534400 // DAY
+        walk = random_walk(zlib.crc32(fsym.encode()), last - first + 1)
+        days = range(max(last - limit, first), last + 1)
+        data = [dict(time=day * DAY, high=walk[day - first] * 1.01, low=walk[day - first] * 0.99,
+                     open=walk[day - first - 1] if day > first else walk[0], close=walk[day - first])
+                for day in days]
+        return await self._answer(request, dict(Response='Success', Data=dict(Data=data)))
+
+    async def price(self, request):
+        fsym = request.query['fsym']
+        return await self._answer(request, {tsym: self._close(fsym, int(time.time()) // DAY)
+                                   for tsym in request.query['tsyms'].split(',')})
+
+    async def pricemulti(self, request):
+        day = int(time.time()) // DAY
+        return await self._answer(request, {fsym: {tsym: self._close(fsym, day) for tsym in request.query['tsyms'].split(',')}
+                                   for fsym in request.query['fsyms'].split(',')})
+
+
+#
+# Agenci bez serwera XMPP
+#
+def use_local_bus():
+    """
+    Replaces XMPP registration and connection of all agents of this process with nothing.
+    Agents registered in the same container exchange messages directly, which makes the
+    container an in-process bus. Agents started with auto_register=True (strategy agents
+    and workers) need no server either.
+    """
+    from spade.agent import Agent
+
+    class Presence:
+        "obecność, której nie ma komu ogłaszać - każda metoda nic nie robi"
+
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: None
+
+    class Connection:
+        "połączenie, którego nie trzeba zamykać (spade 3 zamyka je przez conn_coro.__aexit__)"
+
+        async def __aexit__(self, *args):
+            pass
+
+    async def connect(agent):
+        async def disconnect(*args, **kwargs):
+            pass
+
+        agent.presence = Presence()
+        agent.conn_coro = Connection()
+        if hasattr(agent.client, 'disconnect'):
+            agent.client.disconnect = disconnect
+        if hasattr(agent.client, 'stop'):
+            agent.client.stop = lambda: None
+
+    async def register(agent):
+        pass
+
+    Agent._async_connect = connect
+    if hasattr(Agent, '_async_register'):  # spade 3 - rejestracja in-band przed połączeniem
+        Agent._async_register = register
+
+
+async def stop_local(agent):
+    "zatrzymuje agenta (z jego sprzątaniem) i wyrejestrowuje go z kontenera"
+    await agent.stop()
+    agent.container.unregister(str(agent.jid))
+
+
+def make_probe(jid: str):
+    "agent wysyłający zapytania i mierzący czas do odpowiedzi w tym samym wątku rozmowy"
+    from spade.agent import Agent
+    from spade.behaviour import CyclicBehaviour
+
+    import tools
+
+    class ProbeAgent(Agent):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pending = {}  # wątek -> future odpowiedzi
+            self.collector = None
+
+        async def setup(self):
+            self.collector = self.CollectBehaviour()
+            self.add_behaviour(self.collector)
+
+        async def request(self, message, timeout: float = config.timeout):
+            """
+            :return: (reply, seconds)
+            """
+            message.thread = message.thread or tools.make_uuid()
+            future = self.pending[message.thread] = asyncio.get_event_loop().create_future()
+            start = time.perf_counter()
+            await self.collector.send(message)
+            try:
+                reply = await asyncio.wait_for(future, timeout)
+            finally:
+                self.pending.pop(message.thread, None)
+            return reply, time.perf_counter() - start
+
+        class CollectBehaviour(CyclicBehaviour):
+            async def run(self):
+                message = await self.receive(timeout=1)
+                if message is not None:
+                    future = self.agent.pending.get(message.thread)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+
+    return ProbeAgent(jid, 'probe')
+
+
+#
+# Sekcje
+#
+async def bench_cost(args, records) -> dict:
+    from cost_backend import ProcessPoolCostBackend
+    from cost_function import cost_function_batch
+
+    rng = np.random.default_rng(1)
+    results = {}
+    for size in args.population:
+        population = np.stack([rng.integers(10, 31, size), rng.integers(100, 301, size)], axis=1).tolist()
+        start = time.perf_counter()
+        cost_function_batch(population, records)
+        in_process = time.perf_counter() - start
+
+        backend = ProcessPoolCostBackend(records, max_workers=args.workers)
+        await backend.start()
+        try:
+            await backend.compute_costs(population[:backend.max_workers])  # rozgrzanie procesów
+            start = time.perf_counter()
+            await backend.compute_costs(population)
+            pooled = time.perf_counter() - start
+        finally:
+            await backend.stop()
+        results[str(size)] = dict(in_process_genotypes_per_s=size / in_process, pool_genotypes_per_s=size / pooled,
+                                  pool_workers=backend.max_workers)
+    return results
+
+
+async def bench_ga(args, records) -> dict:
+    from cost_backend import ProcessPoolCostBackend
+    from optimizer import IslandOptimizer
+
+    backend = ProcessPoolCostBackend(records, max_workers=args.workers)
+    await backend.start()
+    calls, genotypes, fitness = 0, 0, {}
+
+    async def evaluate(population):
+        # jak TrainBehaviour.compute_costs - liczone tylko nowe genotypy
+        nonlocal calls, genotypes
+        calls += 1
+        keys = [tuple(genotype) for genotype in population]
+        unseen = list(dict.fromkeys(key for key in keys if key not in fitness))
+        if unseen:
+            genotypes += len(unseen)
+            fitness.update(zip(unseen, await backend.compute_costs(unseen)))
+        return [fitness[key] for key in keys]
+
+    try:
+        optimizer = IslandOptimizer(evaluate, seed=0, generations=args.generations)
+        start = time.perf_counter()
+        best, cost = await optimizer.run()
+        wall = time.perf_counter() - start
+    finally:
+        await backend.stop()
+    generations = (calls - optimizer.islands) / optimizer.islands  # bez oceny populacji początkowych
+    return dict(wall_s=wall, islands=optimizer.islands, generations_per_island=generations,
+                s_per_generation=wall / max(generations, 1), genotypes_scored=genotypes,
+                best=list(best), best_cost=cost)
+
+
+async def bench_history(args, probe) -> dict:
+    import jsonpickle
+
+    import tools
+
+    results = {}
+    for label, request in (('yearly', lambda currency: (currency, None)),
+                           ('last_300_days', lambda currency: (currency, 300))):
+        for phase in ('cold', 'warm'):
+            latencies = []
+            for currency in args.currencies:
+                message = tools.create_message(f'data_agent@{config.domain}', 'inform', 'history',
+                                               jsonpickle.encode(request(currency)))
+                message.set_metadata('accept-encoding', ','.join(tools.ACCEPTED_ENCODINGS))
+                message.set_metadata('columns', ','.join(tools.CLOSE_COLUMNS))  # jak agenci strategii
+                _, seconds = await probe.request(message)
+                latencies.append(seconds)
+            results[f'{label}_{phase}'] = summary(latencies)
+    return results
+
+
+async def bench_decision(args, probe, decision_agent) -> dict:
+    import tools
+
+    start = time.perf_counter()
+    while not set(currency.lower() for currency in args.currencies) <= decision_agent.ready:
+        if time.perf_counter() - start > config.timeout:
+            raise TimeoutError('Strategy agents are not ready')
+        await asyncio.sleep(0.05)
+    prewarm = time.perf_counter() - start
+
+    async def ask(currency):
+        message = tools.create_message(f'decision_agent@{config.domain}', 'request', 'decision', currency)
+        return (await probe.request(message))[1]
+
+    cold = [await ask(currency) for currency in args.currencies]
+    rng = np.random.default_rng(2)
+    currencies = rng.choice(args.currencies, size=args.requests)
+    warm = await asyncio.gather(*(ask(currency) for currency in currencies))
+    return dict(prewarm_s=prewarm, cold=summary(cold), warm=summary(warm))
+
+
+async def bench_websocket(args, port: int) -> dict:
+    import websockets
+
+    rng = np.random.default_rng(3)
+
+    async def client(currencies):
+        latencies = []
+        async with websockets.connect(f'ws://127.0.0.1:{port}') as websocket:
+            for currency in currencies:
+                start = time.perf_counter()
+                await websocket.send(json.dumps(dict(action='decision', body=currency)))
+                while json.loads(await websocket.recv())['status'] == 'Active':
+                    pass  # potwierdzenie przyjęcia zapytania
+                latencies.append(time.perf_counter() - start)
+        return latencies
+
+    results = {}
+    for clients in args.clients:
+        per_client = max(args.requests // clients, 1)
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(client(rng.choice(args.currencies, size=per_client))
+                                           for _ in range(clients)))
+        wall = time.perf_counter() - start
+        results[str(clients)] = dict(summary([latency for client in latencies for latency in client]),
+                                     requests_per_s=clients * per_client / wall)
+    return results
+
+
+async def section(results: dict, name: str, benchmark):
+    "wynik albo błąd sekcji trafia do results od razu, błąd jednej sekcji nie przerywa pozostałych"
+    try:
+        results[name] = await benchmark
+    except Exception as e:
+        traceback.print_exc()
+        results[name] = {'error': f'{type(e).__name__}: {e}'}
+
+
+def failed_sections(results: dict) -> list:
+    return [name for name, result in results.items() if isinstance(result, dict) and 'error' in result]
+
+
+async def run(args, results: dict):
+    """
+    Runs the selected sections, each result (or error) is stored in results as soon as it is known.
+    """
+    records = random_walk(0, args.records)
+    if 'cost' in args.only:
+        await section(results, 'cost', bench_cost(args, records))
+    if 'ga' in args.only:
+        await section(results, 'ga', bench_ga(args, records))
+    if not set(args.only) & {'history', 'decision', 'websocket'}:
+        return
+
+    stub = StubCryptoCompare(latency=args.api_latency)
+    await stub.start()
+    config.API_URL = stub.url
+    use_local_bus()
+
+    from data_agent import DataAgent
+    from database import builder
+    from database.models import Model
+    from database.store import ModelStore
+
+    builder.create_db()
+    models = ModelStore()
+    for currency in args.currencies:
+        models.save_model(Model(currency=currency.lower(), short_mean=20, long_mean=200))
+
+    data_agent = DataAgent(f'data_agent@{config.domain}', 'data_agent')
+    await data_agent.start(auto_register=False)
+    probe = make_probe(f'interface_agent@{config.domain}')
+    await probe.start(auto_register=False)
+    decision_agent = None
+    try:
+        if 'history' in args.only:
+            await section(results, 'history', bench_history(args, probe))
+        if set(args.only) & {'decision', 'websocket'}:
+            from decision_agent import DecisionAgent
+            decision_agent = DecisionAgent(f'decision_agent@{config.domain}', 'decision_agent')
+            await decision_agent.start(auto_register=False)
+        if 'decision' in args.only:
+            await section(results, 'decision', bench_decision(args, probe, decision_agent))
+        if 'websocket' in args.only:
+            await section(results, 'websocket', websocket_section(args, probe))
+    finally:
+        if decision_agent is not None:
+            # agenci strategii (i ich workerzy) nie zatrzymani blokowaliby zamknięcie pętli spade
+            for currency in list(decision_agent.strategy_agents.agents):
+                await decision_agent.stop_strategy_agent(currency)
+        for agent in (decision_agent, data_agent, probe):
+            if agent is not None and agent.is_alive():
+                await stop_local(agent)
+        await stub.stop()
+    results['stub_api_requests'] = stub.requests
+
+
+async def websocket_section(args, probe) -> dict:
+    import websockets
+    from interface_agent import InterfaceAgent
+
+    await stop_local(probe)  # odpowiedzi do interface_agent odbiera teraz prawdziwy agent
+    interface_agent = InterfaceAgent(f'interface_agent@{config.domain}', 'interface_agent')
+
+    async def spawn_agents():
+        pass  # agenci danych i decyzji już działają
+
+    interface_agent.spawn_agents = spawn_agents
+    await interface_agent.start(auto_register=False)
+    server = await websockets.serve(lambda websocket, path=None: interface_agent.hello(websocket, path),
+                                    '127.0.0.1', 0)
+    try:
+        return await bench_websocket(args, server.sockets[0].getsockname()[1])
+    finally:
+        server.close()
+        await stop_local(interface_agent)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', help='path of JSON file with results (printed if not given)')
+    parser.add_argument('--only', nargs='+', choices=SECTIONS, default=list(SECTIONS))
+    parser.add_argument('--quick', action='store_true', help='small sizes, for a smoke run')
+    parser.add_argument('--records', type=int, default=2190, help='length of training series')
+    parser.add_argument('--population', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--generations', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None, help='processes of pool backend')
+    parser.add_argument('--currencies', nargs='+', default=list(CURRENCIES))
+    parser.add_argument('--requests', type=int, default=500, help='decision requests per measurement')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--api-latency', type=float, default=0.0, help='delay of stub API answers in seconds')
+    args = parser.parse_args()
+    if args.quick:
+        args.population, args.generations, args.requests = [500], 5, 50
+        args.currencies, args.clients = args.currencies[:2], [1, 5]
+
+    # baza i archiwum w katalogu tymczasowym, adresy agentów jak na jednym hoście
+    workdir = tempfile.mkdtemp(prefix='stock_advisor_bench_')
+    config.DB_PATH = workdir + os.sep
+    config.ARCHIVE_PATH = os.path.join(workdir, 'archive')
+    config.domain = '127.0.0.1'
+
+    started = time.time()
+    import spade
+    results = {}
+
+    async def collect():
+        try:
+            await run(args, results)
+        except Exception as e:  # błąd poza sekcjami, np. przy uruchamianiu agentów
+            traceback.print_exc()
+            results['setup'] = {'error': f'{type(e).__name__}: {e}'}
+
+    # nowsze wersje spade uruchamiają agentów w pętli spade.run (która nie zwraca wyniku)
+    spade.run(collect()) if hasattr(spade, 'run') else asyncio.run(collect())
+    report = dict(revision=git_revision(), started=started, duration_s=time.time() - started,
+                  python=sys.version.split()[0], platform=platform.platform(), cpus=os.cpu_count(),
+                  arguments=vars(args), results=results)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    else:
+        print(text)
+    failed = failed_sections(results)
+    if failed:
+        sys.exit(f'Failed sections: {", ".join(failed)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Micro-benchmark of job descriptors: deep-copied mutable jobs (JobManager before immutable descriptors)
+against frozen jobs of the current JobManager.
+
+For every population size one "generation" is scheduled: jobs are created and each of them
+is handed out to a worker. Time is the best of several runs, memory is the peak allocated
+during one generation (tracemalloc).
+
+    python -m benchmarks.job_manager_copies
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+from copy import deepcopy
+from dataclasses import dataclass
+
+import numpy as np
+
+import tools
+from job_manager import JobManager
+
+WORKERS = [f'worker_{i}@localhost' for i in range(4)]
+
+
+@dataclass
+class MutableJob:
+    job_id: int
+    worker_id: str
+    data: list
+    result: list = None
+
+
+def deepcopy_generation(population):
+    "tworzenie zadań jak w dawnym JobManager z SAFE_MODE: jedna głęboka kopia każdego wydanego zadania"
+    chunks = filter(None, tools.split_into_chunks(population, len(WORKERS) * JobManager.BATCHES_PER_WORKER))
+    jobs = [MutableJob(i, WORKERS[i % len(WORKERS)], data=chunk, result=[]) for i, chunk in enumerate(chunks)]
+    return [deepcopy(job) for job in jobs]
+
+
+def frozen_generation(population):
+    async def generation():
+        job_manager = JobManager(workers=WORKERS)
+        jobs = await job_manager.create_jobs(population)
+        return [await job_manager.next_job(WORKERS[i % len(WORKERS)]) for i in range(len(jobs))]
+
+    return asyncio.run(generation())
+
+
+def measure(function, population, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(population)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function(population)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f'{"population":>10} {"deepcopy [ms]":>14} {"frozen [ms]":>12} {"deepcopy [KiB]":>15} {"frozen [KiB]":>13}')
+    for size in args.sizes:
+        # genotypy (short_mean, long_mean) jako krotki, jak przekazuje je TrainBehaviour.compute_costs
+        population = [(int(rng.integers(10, 31)), int(rng.integers(100, 301))) for _ in range(size)]
+        old_time, old_peak = measure(deepcopy_generation, population, args.repeat)
+        new_time, new_peak = measure(frozen_generation, population, args.repeat)
+        print(f'{size:>10} {old_time * 1000:>14.1f} {new_time * 1000:>12.1f} '
+              f'{old_peak / 1024:>15.0f} {new_peak / 1024:>13.0f}')
+
+
+if __name__ == '__main__':
+    main()
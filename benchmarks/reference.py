@@ -0,0 +1,41 @@
+"""
+Frozen reference kernels: cost function, moving average and decision exactly as they were
+before the optimizations. Optimized kernels must give bit-for-bit the same results.
+Do not change this module.
+"""
+import numpy as np
+import pandas as pd
+
+
+def calculate_moving_average(length, records):
+    moving_average = pd.Series(records).rolling(window=length).mean().iloc[length - 1:].values
+    moving_average = np.insert(moving_average, 0, [0] * (length - 1))
+    return moving_average
+
+
+def cost_function(length_short, length_long, records):
+    mean_short = calculate_moving_average(length_short, records)  # policzenie krótkiej średniej
+    mean_long = calculate_moving_average(length_long, records)  # policzenie długiej średniej
+    sign = np.sign(
+        mean_short - mean_long)  # wyznaczenie gdzie krótka jest wyżej od długiej (1 dla krótkiej większej od długiej, -1 dla długiej większej od krótkiej)
+    signals = np.sign(sign[:-1] - sign[1:])  # wyznaczenie punktów przecięcia
+    signals = np.insert(signals, 0, 0)
+    buy_signals = np.where(signals == -1, -signals, 0)  # rozdzielenie sygnałów kupna
+    sell_signals = np.where(signals == 1, signals, 0)  # rozdzielenie sygnałów sprzedaży
+    buy_prices = buy_signals * records
+    sell_prices = sell_signals * records
+    buy_prices = buy_prices[buy_prices != 0]
+    sell_prices = sell_prices[sell_prices != 0]
+    total = 0
+    pairs = list(zip(buy_prices, sell_prices))
+    for (buy, sell) in pairs[1:]:
+        total += sell - buy
+
+    return total
+
+
+def decision(length_short, length_long, records):
+    meaning_records = records[-length_long:]
+    mean_short = calculate_moving_average(length_short, meaning_records)  # policzenie krótkiej średniej
+    mean_long = calculate_moving_average(length_long, meaning_records)  # policzenie długiej średniej
+    return mean_short[-1] > mean_long[-1]
@@ -0,0 +1,95 @@
+"""
+ColumnarArchive: appends, updates, out-of-order inserts, crash recovery and concurrent readers.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from database.archive import ColumnarArchive
+from database.store import ROW_COLUMNS
+
+DAY = 86400
+
+
+def rows(days, value=lambda day: float(day)):
+    "wiersze (time, high, low, open, close), w których wszystkie ceny są równe"
+    return [(day * DAY,) + (value(day),) * 4 for day in days]
+
+
+def stored(archive, currency='btc'):
+    return [tuple(row) for row in zip(*archive.get_range(currency, columns=ROW_COLUMNS))]
+
+
+def test_append(tmp_path):
+    archive = ColumnarArchive(str(tmp_path))
+    assert archive.bulk_upsert('btc', rows(range(3))) == (3, 0)
+    assert archive.bulk_upsert('btc', rows(range(3, 5))) == (2, 0)
+    assert stored(archive) == rows(range(5))
+    assert archive.count('btc', 1 * DAY, 3 * DAY) == 3 and archive.last_time('btc') == 4 * DAY
+
+
+def test_update_does_not_change_returned_views(tmp_path):
+    archive = ColumnarArchive(str(tmp_path))
+    archive.bulk_upsert('btc', rows(range(5)))
+    times, close = archive.get_range('btc', columns=('time', 'close'))
+
+    assert archive.bulk_upsert('btc', rows([1, 3, 5], value=lambda day: -day)) == (1, 2)
+    assert list(close) == [0, 1, 2, 3, 4] and len(times) == 5  # widoki sprzed zapisu bez zmian
+    assert [row[4] for row in stored(archive)] == [0, -1, 2, -3, 4, -5]
+
+
+def test_out_of_order_insert_rewrites_columns(tmp_path):
+    archive = ColumnarArchive(str(tmp_path))
+    archive.bulk_upsert('btc', rows([2, 4, 6]))
+    old = archive.get_range('btc', columns=ROW_COLUMNS)
+    assert archive.bulk_upsert('btc', rows([5, 1, 3, 7])) == (4, 0)
+    assert stored(archive) == rows(range(1, 8))
+    assert [list(column) for column in old] == [list(column) for column in zip(*rows([2, 4, 6]))]
+
+
+def test_interrupted_append_is_not_visible_and_is_truncated(tmp_path):
+    archive = ColumnarArchive(str(tmp_path))
+    archive.bulk_upsert('btc', rows(range(3)))
+    # przerwane dopisywanie: ceny zapisane (jedna częściowo), kolumna czasu tylko w połowie wartości
+    for column in ROW_COLUMNS[1:]:
+        with open(os.path.join(str(tmp_path), 'btc', f'{column}.bin'), 'ab') as file:
+            file.write(np.array([99.0, 99.0], dtype='<f8').tobytes()[:12])
+    with open(os.path.join(str(tmp_path), 'btc', 'time.bin'), 'ab') as file:
+        file.write(np.array([3 * DAY], dtype='<i8').tobytes()[:4])
+
+    archive = ColumnarArchive(str(tmp_path))
+    assert stored(archive) == rows(range(3))
+    assert archive.bulk_upsert('btc', rows(range(3, 5))) == (2, 0)
+    assert stored(archive) == rows(range(5))
+
+
+def test_concurrent_readers_see_whole_writes(tmp_path):
+    archive = ColumnarArchive(str(tmp_path))
+    archive.bulk_upsert('btc', rows(range(100), value=lambda day: 0.0))
+    errors = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            columns = archive.get_range('btc', columns=ROW_COLUMNS)
+            prices = np.array(columns[1:])
+            versions = np.unique(prices)
+            # zapis zmienia wszystkie ceny naraz, odczyt nie może łączyć dwóch wersji
+            if len(versions) != 1 or not np.array_equal(columns[0], np.arange(len(columns[0])) * DAY):
+                errors.append(versions)
+            time.sleep(0.001)  # widoki są używane już po odczycie (jak w DataAgent), nie mogą się zmienić
+            if not np.array_equal(prices, np.array(columns[1:])):
+                errors.append('changed')
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for version in range(1, 50):
+        archive.bulk_upsert('btc', rows(range(100 + version), value=lambda day: float(version)))
+    done.set()
+    for reader in readers:
+        reader.join()
+    assert errors == []
+    assert stored(archive) == rows(range(149), value=lambda day: 49.0)
@@ -0,0 +1,43 @@
+"""
+DecisionAgent bookkeeping of interface requests waiting for a strategy agent (no XMPP needed).
+"""
+import jsonpickle
+import pytest
+
+import config
+from decision_agent import DecisionAgent
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setattr(config, 'domain', '127.0.0.1')
+    return DecisionAgent(f'decision_agent@{config.domain}', 'decision_agent')
+
+
+def answers(messages):
+    return sorted((message.thread, tuple(jsonpickle.decode(message.body))) for message in messages)
+
+
+def test_waiting_requests_expire_when_strategy_agent_is_not_ready(agent):
+    agent.waiting['btc'] = [('first', 10.0), ('second', 20.0)]
+    agent.waiting['eth'] = [('third', 30.0)]
+
+    assert agent.expired_answers(now=5.0) == []
+    assert answers(agent.expired_answers(now=15.0)) == [('first', ('btc', 'not available'))]
+    assert agent.waiting == {'btc': [('second', 20.0)], 'eth': [('third', 30.0)]}
+    assert agent.decision_query('btc') is None  # agent strategii wciąż się uczy
+
+    assert answers(agent.expired_answers(now=30.0)) == [('second', ('btc', 'not available')),
+                                                        ('third', ('eth', 'not available'))]
+    assert agent.waiting == {}
+
+
+def test_answer_of_ready_agent_goes_to_all_waiting_requests(agent):
+    agent.waiting['btc'] = [('first', 10.0), ('second', 20.0)]
+    agent.ready.add('btc')
+
+    query = agent.decision_query('btc')
+    assert query is not None and agent.decision_query('btc') is None  # zapytanie już wysłane
+
+    assert answers(agent.decision_answers('btc', 'buy')) == [('first', ('btc', 'buy')), ('second', ('btc', 'buy'))]
+    assert agent.expired_answers(now=30.0) == []
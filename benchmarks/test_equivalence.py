@@ -0,0 +1,111 @@
+"""
+Bit-for-bit equivalence of the kernels with the frozen reference (benchmarks/reference.py).
+"""
+import numpy as np
+import pytest
+
+from benchmarks import reference
+from benchmarks.conftest import WINDOWS, make_series
+from cost_function import cost_function, cost_function_batch
+from decision import CrossoverState, decision, records2
+from moving_average import MovingAverageCache, calculate_moving_average
+
+
+def assert_identical(actual, expected):
+    actual, expected = np.asarray(actual), np.asarray(expected)
+    assert actual.shape == expected.shape
+    assert actual.tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize('window', [1, 2, 10, 100, 300])
+def test_moving_average(records, window):
+    expected = reference.calculate_moving_average(window, records)
+    assert_identical(calculate_moving_average(window, records), expected)
+    cache = MovingAverageCache()
+    assert_identical(cache.get(window, records), expected)
+    assert_identical(cache.get(window, records), expected)
+    assert cache.stats()['hits'] == 1
+
+
+@pytest.mark.parametrize('length_short,length_long', WINDOWS)
+def test_cost_function(records, length_short, length_long):
+    expected = reference.cost_function(length_short, length_long, records)
+    assert_identical(cost_function(length_short, length_long, records, MovingAverageCache()), expected)
+
+
+def test_cost_function_batch(records):
+    rng = np.random.default_rng(len(records))
+    params = np.stack([rng.integers(1, 31, 200), rng.integers(50, 301, 200)], axis=1)
+    params = np.concatenate([params, WINDOWS, [(100, 10), (20, 20)]])  # także krótka dłuższa od długiej i równe
+    expected = [reference.cost_function(int(short), int(long), records) for short, long in params]
+    assert_identical(cost_function_batch(params, records, MovingAverageCache()), expected)
+
+
+def test_cost_function_batch_in_chunks(monkeypatch):
+    import cost_function as module
+    records = make_series(2190)
+    params = [(short, long) for short in range(10, 31, 5) for long in range(100, 301, 50)]
+    expected = cost_function_batch(params, records, MovingAverageCache())
+    monkeypatch.setattr(module, 'BATCH_ELEMENTS', len(records) * 3)
+    assert_identical(cost_function_batch(params, records, MovingAverageCache()), expected)
+
+
+def test_first_pair_is_skipped():
+    # krótka średnia przecina długą wiele razy, zysk z pierwszej pary kupno-sprzedaż nie jest liczony
+    records = 100 + 10 * np.sin(np.linspace(0, 12 * np.pi, 600))
+    expected = reference.cost_function(5, 40, records)
+    assert_identical(cost_function(5, 40, records, MovingAverageCache()), expected)
+    assert_identical(cost_function_batch([(5, 40)], records, MovingAverageCache()), [expected])
+
+    signals = np.diff(np.sign(reference.calculate_moving_average(5, records)
+                              - reference.calculate_moving_average(40, records)))
+    buys, sells = records[1:][signals > 0], records[1:][signals < 0]
+    all_pairs = sum(sell - buy for buy, sell in zip(buys, sells))
+    assert len(list(zip(buys, sells))) > 2
+    assert expected != all_pairs
+
+
+@pytest.mark.filterwarnings('ignore:invalid value:RuntimeWarning')
+@pytest.mark.parametrize('bad', [np.nan, np.inf, -np.inf])
+def test_non_finite_records(bad):
+    # NaN w cenie trafia do par kupna/sprzedaży także bez sygnału, jak w referencji
+    params = [(short, long) for short in (5, 10, 20) for long in (40, 100)]
+    for positions in ([150], [3], [0, 299], [50, 51, 52]):
+        records = make_series(300).copy()
+        records[positions] = bad
+        expected = [reference.cost_function(short, long, records) for short, long in params]
+        assert_identical([cost_function(short, long, records, MovingAverageCache()) for short, long in params],
+                         expected)
+        assert_identical(cost_function_batch(params, records, MovingAverageCache()), expected)
+
+
+def test_zero_records():
+    params = [(5, 40), (10, 100)]
+    records = make_series(300).copy()
+    records[[10, 120, 121, 250]] = 0
+    expected = [reference.cost_function(short, long, records) for short, long in params]
+    assert_identical(cost_function_batch(params, records, MovingAverageCache()), expected)
+
+
+def test_cost_function_batch_rejects_invalid_windows():
+    with pytest.raises(ValueError):
+        cost_function_batch([(0, 10)], make_series(300))
+    with pytest.raises(ValueError):
+        cost_function_batch([(10, 301)], make_series(300))
+
+
+@pytest.mark.parametrize('length_short,length_long', [(20, 200)] + WINDOWS)
+def test_decision(length_short, length_long):
+    for records in (records2, list(make_series(2190))):
+        assert decision(length_short, length_long, records, MovingAverageCache()) == \
+            reference.decision(length_short, length_long, records)
+
+
+@pytest.mark.parametrize('length_short,length_long', WINDOWS)
+def test_crossover_state(length_short, length_long):
+    records = list(make_series(3000, seed=1))
+    state = CrossoverState(length_short, length_long, records[:length_long])
+    assert state.decision == reference.decision(length_short, length_long, records[:length_long])
+    for end in range(length_long + 1, len(records) + 1):
+        state.update(records[end - 1])
+        assert state.decision == reference.decision(length_short, length_long, records[:end])
@@ -0,0 +1,47 @@
+"""
+Columns of historical data chosen by the requester and read from the covering index.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+import tools
+from database import builder, models
+from database.store import RecordStore
+
+
+def test_requested_columns():
+    assert tools.requested_columns(None) == tuple(tools.HISTORY_COLUMNS)  # starsi klienci
+    assert tools.requested_columns('') == tuple(tools.HISTORY_COLUMNS)
+    assert tools.requested_columns(','.join(tools.CLOSE_COLUMNS)) == ('time', 'close')
+    assert tools.requested_columns('close, open') == ('time', 'close', 'open')
+    assert tools.requested_columns('close,volume') == ('time', 'close')
+
+
+def test_close_columns_are_read_from_covering_index(tmp_path):
+    engine = builder.make_engine(str(tmp_path / 'crypto.db'))
+    models.Base.metadata.create_all(engine)
+    store = RecordStore(sessionmaker(bind=engine))
+    store.upsert([models.Record(currency='btc', time=day * 86400, high=1.0, low=1.0, open=1.0, close=float(day))
+                  for day in range(10)])
+
+    statements = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    def plan(columns):
+        statements.clear()
+        values = store.get_range('btc', 2 * 86400, None, columns)
+        statement, parameters = statements[-1]
+        with engine.connect() as connection:
+            rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        return values, ' '.join(str(row[-1]) for row in rows)
+
+    (times, closes), detail = plan(tools.requested_columns(','.join(tools.CLOSE_COLUMNS)))
+    assert list(closes) == [float(day) for day in range(2, 10)]
+    assert 'COVERING INDEX _currency_time_close_ix_' in detail
+
+    _, detail = plan(tools.requested_columns(None))
+    assert 'COVERING INDEX' not in detail
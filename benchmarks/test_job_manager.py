@@ -0,0 +1,159 @@
+"""
+JobManager scheduling: pull order, speculative copies, failures and streaming of results.
+"""
+import asyncio
+import time
+
+import pytest
+
+from job_manager import JobManager
+
+WORKERS = ['worker_1', 'worker_2', 'worker_3']
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=10))
+
+
+def count_takes(job_manager):
+    "licznik wywołań _take - pętla next_job nie może kręcić się w miejscu"
+    calls = [0]
+    take = job_manager._take
+
+    def counted(worker_id):
+        calls[0] += 1
+        return take(worker_id)
+
+    job_manager._take = counted
+    return calls
+
+
+def test_jobs_are_pulled_in_order():
+    async def test():
+        job_manager = JobManager(workers=WORKERS[:2])
+        jobs = await job_manager.create_jobs(list(range(8)), max_jobs=4)
+        assert [job.data for job in jobs] == [(0, 1), (2, 3), (4, 5), (6, 7)]
+
+        taken = [await job_manager.next_job(WORKERS[i % 2]) for i in range(4)]
+        assert [job.job_id for job in taken] == [0, 1, 2, 3]
+        assert [job.worker_id for job in taken] == [WORKERS[0], WORKERS[1], WORKERS[0], WORKERS[1]]
+        for job in reversed(taken):
+            assert await job_manager.job_done(job.with_result([x * 10 for x in job.data]))
+        assert await job_manager.next_job(WORKERS[0]) is None
+        assert await job_manager.jobs_finished() == [x * 10 for x in range(8)]
+    run(test())
+
+
+def test_batch_size_and_unknown_worker():
+    async def test():
+        job_manager = JobManager(workers=WORKERS[:1])
+        jobs = await job_manager.create_jobs(list(range(5)), batch_size=2)
+        assert [job.data for job in jobs] == [(0, 1), (2, 3), (4,)]
+        with pytest.raises(ValueError):
+            await job_manager.next_job('nobody')
+    run(test())
+
+
+def test_overdue_job_is_copied_and_first_result_wins():
+    async def test():
+        job_manager = JobManager(workers=WORKERS[:2], job_timeout=0.05)
+        await job_manager.create_jobs([1, 2], max_jobs=1)
+        slow = await job_manager.next_job(WORKERS[0])
+
+        start = time.monotonic()
+        fast = await job_manager.next_job(WORKERS[1])  # czeka, aż zadanie się spóźni
+        assert time.monotonic() - start >= 0.04
+        assert (fast.job_id, fast.worker_id) == (slow.job_id, WORKERS[1])
+
+        assert await job_manager.job_done(fast.with_result([10, 20]))
+        assert job_manager.is_done(slow.job_id)
+        assert not await job_manager.job_done(slow.with_result([-1, -1]))
+        assert await job_manager.jobs_finished() == [10, 20]
+    run(test())
+
+
+def test_copies_are_limited():
+    async def test():
+        job_manager = JobManager(workers=WORKERS, job_timeout=0.02)
+        await job_manager.create_jobs([1], max_jobs=1)
+        first = await job_manager.next_job(WORKERS[0])
+        second = await job_manager.next_job(WORKERS[1])
+        assert first.job_id == second.job_id
+
+        takes = count_takes(job_manager)
+        third = asyncio.ensure_future(job_manager.next_job(WORKERS[2]))
+        await asyncio.sleep(0.3)
+        assert not third.done() and takes[0] < 5  # MAX_COPIES osiągnięte - czeka bez kręcenia się
+
+        await job_manager.job_done(second.with_result([1]))
+        assert await third is None
+    run(test())
+
+
+def test_failed_worker_waits_without_spinning():
+    async def test():
+        job_manager = JobManager(workers=WORKERS[:2], job_timeout=0.02)
+        await job_manager.create_jobs([1, 2], max_jobs=1)
+        job = await job_manager.next_job(WORKERS[0])
+        await job_manager.job_failed(job)
+
+        retry = await job_manager.next_job(WORKERS[1])  # zadanie wraca na początek kolejki
+        assert retry.job_id == job.job_id
+
+        takes = count_takes(job_manager)
+        failed = asyncio.ensure_future(job_manager.next_job(WORKERS[0]))
+        await asyncio.sleep(0.3)  # zadanie drugiego workera jest już dawno spóźnione
+        assert not failed.done() and takes[0] < 5
+
+        await job_manager.job_done(retry.with_result([3, 4]))
+        assert await failed is None
+        assert await job_manager.jobs_finished() == [3, 4]
+    run(test())
+
+
+def test_cancelled_job_releases_worker():
+    async def test():
+        job_manager = JobManager(workers=WORKERS[:2], job_timeout=0.01)
+        await job_manager.create_jobs([1], max_jobs=1)
+        first = await job_manager.next_job(WORKERS[0])
+        copy = await job_manager.next_job(WORKERS[1])
+        assert await job_manager.job_done(first.with_result([5]))
+        await job_manager.job_cancelled(copy)
+        assert all(descriptor.assigned_jobs == 0 for descriptor in job_manager._workers.values())
+        assert job_manager._running == {}
+    run(test())
+
+
+def test_results_are_streamed_in_order_of_completion():
+    async def test():
+        job_manager = JobManager(workers=WORKERS[:1])
+        await job_manager.create_jobs([0, 1, 2], max_jobs=3)
+        jobs = [await job_manager.next_job(WORKERS[0]) for _ in range(3)]
+        streamed = []
+
+        async def consume():
+            async for job_id, result in job_manager.results():
+                streamed.append((job_id, result))
+
+        consumer = asyncio.ensure_future(consume())
+        for job in (jobs[2], jobs[0], jobs[1]):
+            await job_manager.job_done(job.with_result([job.data[0] * 2]))
+            await asyncio.sleep(0.01)
+            assert streamed[-1] == (job.job_id, (job.data[0] * 2,))
+        await consumer
+        assert [job_id for job_id, _ in streamed] == [2, 0, 1]
+        assert await job_manager.jobs_finished() == [0, 2, 4]
+    run(test())
+
+
+def test_late_reports_after_reset_are_ignored():
+    async def test():
+        job_manager = JobManager(workers=WORKERS[:2], job_timeout=0.01)
+        await job_manager.create_jobs([1], max_jobs=1)
+        first = await job_manager.next_job(WORKERS[0])
+        copy = await job_manager.next_job(WORKERS[1])
+        await job_manager.job_done(first.with_result([1]))
+        assert await job_manager.jobs_finished() == [1]
+        assert not await job_manager.job_done(copy.with_result([2]))
+        await job_manager.job_failed(copy)
+    run(test())
@@ -0,0 +1,62 @@
+"""
+Micro-benchmarks of the kernels against the frozen reference (requires pytest-benchmark):
+
+    python -m pytest benchmarks/test_kernels_benchmark.py --benchmark-group-by=group
+"""
+import numpy as np
+import pytest
+
+from benchmarks import reference
+from benchmarks.conftest import WINDOWS, make_series
+from cost_function import cost_function, cost_function_batch
+from decision import CrossoverState, decision
+from moving_average import MovingAverageCache, calculate_moving_average
+
+pytest.importorskip('pytest_benchmark')
+
+IMPLEMENTATIONS = ['reference', 'current']
+
+
+@pytest.mark.parametrize('implementation', IMPLEMENTATIONS)
+@pytest.mark.parametrize('window', [10, 100, 300])
+def test_moving_average(benchmark, records, window, implementation):
+    benchmark.group = f'moving_average n={len(records)} window={window}'
+    kernel = reference.calculate_moving_average if implementation == 'reference' else calculate_moving_average
+    benchmark(kernel, window, records)
+
+
+@pytest.mark.parametrize('implementation', IMPLEMENTATIONS)
+@pytest.mark.parametrize('length_short,length_long', WINDOWS)
+def test_cost_function(benchmark, records, length_short, length_long, implementation):
+    benchmark.group = f'cost_function n={len(records)} windows=({length_short}, {length_long})'
+    if implementation == 'reference':
+        benchmark(reference.cost_function, length_short, length_long, records)
+    else:
+        # bez cache, żeby mierzyć liczenie średnich, a nie trafienia
+        benchmark(lambda: cost_function(length_short, length_long, records, MovingAverageCache()))
+
+
+@pytest.mark.parametrize('implementation', IMPLEMENTATIONS)
+def test_cost_function_population(benchmark, records, implementation):
+    "jedno pokolenie algorytmu genetycznego: 48 losowych par parametrów"
+    benchmark.group = f'population n={len(records)}'
+    rng = np.random.default_rng(0)
+    params = np.stack([rng.integers(10, 31, 48), rng.integers(100, 301, 48)], axis=1)
+    if implementation == 'reference':
+        benchmark(lambda: [reference.cost_function(int(short), int(long), records) for short, long in params])
+    else:
+        benchmark(lambda: cost_function_batch(params, records, MovingAverageCache()))
+
+
+@pytest.mark.parametrize('implementation', IMPLEMENTATIONS + ['crossover'])
+def test_decision(benchmark, implementation):
+    "decyzja po dopisaniu nowego kursu do 300 dni danych"
+    benchmark.group = 'decision'
+    records = list(make_series(300))
+    if implementation == 'reference':
+        benchmark(reference.decision, 20, 200, records)
+    elif implementation == 'current':
+        benchmark(lambda: decision(20, 200, records, MovingAverageCache()))
+    else:
+        state = CrossoverState(20, 200, records)
+        benchmark(lambda: (state.update(records[-1]), state.decision))
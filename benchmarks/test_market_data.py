@@ -0,0 +1,112 @@
+"""
+MarketDataClient and PriceCache against the local CryptoCompare stub (benchmarks.harness.StubCryptoCompare).
+"""
+import asyncio
+import time
+
+from benchmarks.harness import StubCryptoCompare
+from market_data import MarketDataClient, PriceCache, RateLimiter
+
+
+def run(test, latency: float = 0.0):
+    "uruchamia test(stub, client) z zaślepką API i zamyka wszystko po nim"
+    async def main():
+        stub = StubCryptoCompare(latency=latency)
+        await stub.start()
+        client = MarketDataClient(base_url=stub.url, api_key='', requests_per_second=1000)
+        try:
+            return await test(stub, client)
+        finally:
+            await client.close()
+            await stub.stop()
+    return asyncio.run(main())
+
+
+def test_identical_requests_are_coalesced():
+    async def test(stub, client):
+        answers = await asyncio.gather(*(client.price('BTC', 'PLN') for _ in range(20)))
+        assert stub.requests == 1
+        assert client.requests_sent == 1 and client.requests_coalesced == 19
+        assert all(answer == answers[0] for answer in answers)
+
+        await client.price('BTC', 'PLN')  # zakończone zapytanie nie jest już współdzielone
+        assert stub.requests == 2
+    run(test, latency=0.05)
+
+
+def test_different_requests_are_not_coalesced():
+    async def test(stub, client):
+        await asyncio.gather(client.price('BTC', 'PLN'), client.price('ETH', 'PLN'), client.price('BTC', 'USD'))
+        assert stub.requests == 3 and client.requests_coalesced == 0
+    run(test, latency=0.05)
+
+
+def test_rate_limiter_spacing():
+    async def test():
+        limiter = RateLimiter(rate=20, burst=1)
+        times = []
+        for _ in range(6):
+            await limiter.acquire()
+            times.append(time.monotonic())
+        return times
+    times = asyncio.run(test())
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    assert min(gaps) >= 0.045
+    assert times[-1] - times[0] >= 5 / 20 * 0.95
+
+
+def test_rate_limiter_burst():
+    async def test():
+        limiter = RateLimiter(rate=2, burst=5)
+        start = time.monotonic()
+        for _ in range(5):
+            await limiter.acquire()
+        return time.monotonic() - start
+    assert asyncio.run(test()) < 0.1
+
+
+def test_price_cache_stale_while_revalidate():
+    async def test(stub, client):
+        cache = PriceCache(client, ttl=0.05, stale_ttl=0.5)
+        price = await cache.get('BTC', 'PLN')
+        assert price is not None and stub.requests == 1
+
+        assert await cache.get('BTC', 'PLN') == price  # świeża
+        assert stub.requests == 1
+
+        await asyncio.sleep(0.06)
+        stub.latency = 0.1
+        start = time.monotonic()
+        assert await cache.get('BTC', 'PLN') == price  # nieaktualna, zwrócona bez czekania na API
+        assert time.monotonic() - start < 0.05
+        assert await cache.get('BTC', 'PLN') == price  # odświeżanie w tle tylko jedno
+        await asyncio.sleep(0.2)
+        assert stub.requests == 2
+        assert cache.stats() == dict(hits=1, stale_hits=2, misses=1, watched=1)
+
+        await asyncio.sleep(0.6)  # starsza niż stale_ttl - zapytanie czeka na API
+        start = time.monotonic()
+        assert await cache.get('BTC', 'PLN') == price
+        assert time.monotonic() - start >= 0.1
+        assert stub.requests == 3 and cache.misses == 2
+    run(test)
+
+
+def test_refresh_watched_uses_one_request():
+    async def test(stub, client):
+        cache = PriceCache(client, ttl=60)
+        for fsym in ('BTC', 'ETH', 'LTC'):
+            await cache.get(fsym, 'PLN')
+        assert stub.requests == 3
+        await cache.refresh_watched()
+        assert stub.requests == 4
+    run(test)
+
+
+def test_connection_is_reused():
+    async def test(stub, client):
+        for limit in range(10):
+            await client.histoday('BTC', 'PLN', limit + 1)
+        assert stub.requests == 10
+        assert len(stub.peers) == 1
+    run(test)
@@ -1,10 +1,71 @@
 domain = ""
 
 DB_PATH = ""
+# ustawienia SQLite (database.builder.make_engine)
+DB_JOURNAL_MODE = "WAL"  # czytający nie czekają na zapisującego
+DB_SYNCHRONOUS = "NORMAL"  # w trybie WAL bezpieczne dla spójności bazy
+DB_CACHE_SIZE = -64000  # ujemne - w KiB na połączenie
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_BUSY_TIMEOUT = 30  # ile sekund czekać na blokadę zapisu
+DB_POOL_SIZE = 5  # połączeń w puli, wątki DataAgenta biorą je na czas jednej sesji
 API_KEY = ""
+API_URL = "https://min-api.cryptocompare.com"
+API_RATE_LIMIT = 10  # maksymalna liczba zapytań do API na sekundę
+API_CONNECTIONS = 10  # rozmiar puli połączeń keep-alive
+
+# cache aktualnych kursów (w sekundach)
+PRICE_TTL = 10  # kurs młodszy niż TTL jest zwracany bez zapytania
+PRICE_STALE_TTL = 300  # starszy, ale młodszy niż STALE_TTL jest zwracany i odświeżany w tle
+PRICE_WATCH_TTL = 600  # jak długo od ostatniego zapytania waluta jest odświeżana w tle
+PRICE_REFRESH = 5  # co ile odświeżane są obserwowane waluty
 
 timeout = 100
 
+METRICS = True  # pomiary zachowań agentów (metrics.py), wystawiane przez InterfaceAgent pod /metrics
+
 TRAIN_OPERATION = "Train"
 DECISION_OPERATION = "Decision"
 LIST_OPERATION = "List"
+
+# backend liczenia funkcji kosztu: "pool" - procesy lokalne, "xmpp" - agenci StrategyAgentWorker
+COST_BACKEND = "pool"
+POOL_WORKERS = None  # None - wszystkie rdzenie
+XMPP_WORKERS = 2
+
+# tryb treningu: "ga" - algorytm genetyczny, "grid" - przeszukanie całej siatki parametrów
+TRAINING_MODE = "ga"
+GRID_SHORT_WINDOWS = None  # np. range(10, 31, 2), None - cały GA_SHORT_RANGE
+GRID_LONG_WINDOWS = None  # None - cały GA_LONG_RANGE
+GRID_CHUNK = 1024  # ile par parametrów liczy jedno wywołanie backendu
+
+# algorytm genetyczny (optimizer.IslandOptimizer), każda wyspa ewoluuje niezależnie
+GA_SHORT_RANGE = (10, 30)  # zakres krótkiej średniej
+GA_LONG_RANGE = (100, 300)  # zakres długiej średniej
+GA_ISLANDS = 4
+GA_POPULATION = 12  # rozmiar populacji jednej wyspy
+GA_GENERATIONS = 40
+GA_MUTATION_RATE = 0.3  # prawdopodobieństwo mutacji każdego genu
+GA_MUTATION_STEP = 5  # maksymalna zmiana genu przy mutacji
+GA_CROSSOVER_RATE = 0.7
+GA_MIGRATION_INTERVAL = 5  # co ile pokoleń najlepsze osobniki przechodzą na następną wyspę
+GA_MIGRANTS = 2
+GA_PATIENCE = 10  # wyspa kończy, gdy jej najlepszy wynik nie poprawił się przez tyle pokoleń
+GA_SEED = None
+
+HISTORY_TTL = 300  # co ile sekund DataAgent dociąga z sieci ostatnie dni
+DECISION_DAYS = 300  # z ilu ostatnich dni agent strategii podejmuje decyzję (nie mniej niż najdłuższa średnia)
+DECISION_REFRESH = 3600  # co ile sekund agent strategii dociąga nowe kursy zamknięcia
+DB_WORKERS = 4  # ile wątków DataAgenta pracuje jednocześnie z bazą
+
+# silnik danych historycznych: "sqlite" - tabela records, "archive" - pliki kolumnowe czytane przez np.memmap
+STORAGE_ENGINE = "sqlite"
+ARCHIVE_PATH = f"{DB_PATH}archive"
+
+# agenci strategii uruchamiani przez DecisionAgent
+PREWARM_STRATEGIES = True  # przy starcie uruchamia agentów dla wszystkich walut z zapisanym modelem
+PREWARM_CONCURRENCY = 10  # ilu agentów może się rejestrować jednocześnie
+STRATEGY_IDLE_TTL = 3600  # po ilu sekundach bez zapytań agent jest zatrzymywany
+STRATEGY_EVICT_PERIOD = 60  # co ile sekund szukani są bezczynni agenci
+DECISION_QUERY_TIMEOUT = 10  # po ilu sekundach bez odpowiedzi agenta strategii zapytanie jest porzucane
+DECISION_QUERY_CHECK = 1  # co ile sekund sprawdzane są terminy zapytań
+DECISION_WAIT_TIMEOUT = 60  # ile sekund zapytanie interfejsu czeka na gotowość agenta strategii (np. trening)
@@ -0,0 +1,203 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import jsonpickle
+import numpy as np
+from spade.behaviour import OneShotBehaviour
+from spade.template import Template
+
+import config
+import tools
+from config import domain
+from cost_function import cost_function_batch
+from job_manager import JobManager
+from protocol import request_cost_computation, request_training_data, give_training_data
+from strategy_worker_agent import StrategyAgentWorker
+from tools import message_from_template
+
+
+class CostBackend:
+    """
+    Computes costs of genotypes for StrategyAgent.TrainBehaviour.
+    """
+
+    async def start(self):
+        pass
+
+    async def compute_costs(self, population: list) -> list:
+        """
+        :param population: list of (short_mean, long_mean) genotypes
+        :return: list of costs in the order of population
+        """
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+
+class XmppCostBackend(CostBackend):
+    """
+    Distributes population between StrategyAgentWorker agents through XMPP.
+    Workers are started once per strategy agent (and stopped with it) and receive training records
+    only when they do not hold records with the current digest yet.
+    """
+
+    def __init__(self, agent, records, nworkers: int = 2):
+        self.agent = agent
+        self.workers = [f'strategy_agent_worker_{agent.currency_symbol}_{i}@{domain}' for i in range(1, nworkers + 1)]
+        self.records = np.asarray(records, dtype=np.float64)
+        self.records_digest = tools.fingerprint(self.records)
+        self.records_blob = None
+
+    def get_records_blob(self) -> str:
+        if self.records_blob is None:
+            self.records_blob = tools.pack_floats(self.records)
+        return self.records_blob
+
+    async def start(self):
+        for worker_jid in self.workers:
+            if worker_jid not in self.agent.workers:
+                worker = StrategyAgentWorker(worker_jid, worker_jid, self.agent.currency_symbol)
+                await worker.start(auto_register=True)
+                self.agent.workers[worker_jid] = worker
+
+    async def compute_costs(self, population):
+        # osobny JobManager dla każdego wywołania - wyspy algorytmu genetycznego liczą koszty równolegle
+        job_manager = JobManager(workers=self.workers)
+        await job_manager.create_jobs(data=population)
+        for worker_jid in self.workers:
+            uuid = tools.make_uuid()
+            template = Template(thread=uuid)
+            self.agent.add_behaviour(WorkerConversationBehaviour(worker_jid, uuid, self, job_manager), template)
+
+        return await job_manager.jobs_finished()
+
+
+class WorkerConversationBehaviour(OneShotBehaviour):
+    """
+    Conversation with one worker, which takes jobs from job manager until all of them are done.
+    Replies carry id of the job in 'job' metadata, so late replies to abandoned jobs are skipped.
+    """
+    ATTEMPTS = 2
+
+    def __init__(self, worker_id, uuid, backend: XmppCostBackend, job_manager: JobManager, *args, **kwargs):
+        super(WorkerConversationBehaviour, self).__init__()
+        self.worker_id = worker_id
+        self.conversation_id = uuid
+        self.backend = backend
+        self.job_manager = job_manager
+
+    async def run(self):
+        while True:
+            job = await self.job_manager.next_job(self.worker_id)
+            if job is None:
+                return
+            reply = None
+            for attempt in range(self.ATTEMPTS):
+                reply = await self.request_costs(job)
+                if reply is not None or self.job_manager.is_done(job.job_id):
+                    break
+
+            if reply is not None:
+                job = job.with_result(jsonpickle.loads(reply.body))
+                self.agent.log.debug('Reply from worker {} arrived: {}'.format(reply.sender, job.result))
+                await self.job_manager.job_done(job)
+            elif self.job_manager.is_done(job.job_id):
+                self.agent.log.debug('Job {} was done by another worker'.format(job.job_id))
+                await self.job_manager.job_cancelled(job)
+            else:
+                self.agent.log.error('Reply from worker {} not arrived!'.format(job.worker_id))
+                await self.job_manager.job_failed(job)
+
+    async def request_costs(self, job):
+        metadata = dict(request_cost_computation.metadata, records=self.backend.records_digest, job=str(job.job_id))
+        msg = message_from_template(request_cost_computation,
+                                    body=jsonpickle.dumps(job.data),
+                                    to=job.worker_id,
+                                    thread=self.conversation_id,
+                                    metadata=metadata)
+        await self.send(msg)
+        reply = await self.receive_reply(job)
+        if reply and request_training_data.match(reply):
+            self.agent.log.debug('Sending training data to worker {}'.format(reply.sender))
+            data_msg = message_from_template(give_training_data,
+                                             body=self.backend.get_records_blob(),
+                                             to=job.worker_id,
+                                             thread=self.conversation_id,
+                                             metadata=dict(give_training_data.metadata,
+                                                           records=self.backend.records_digest))
+            await self.send(data_msg)
+            reply = await self.receive_reply(job)
+        return reply
+
+    async def receive_reply(self, job):
+        "czeka na odpowiedz dotyczaca zadania, przestaje czekac, gdy zadanie zrobil inny worker"
+        deadline = time.monotonic() + config.timeout
+        done = asyncio.ensure_future(self.job_manager.wait_done(job.job_id))
+        try:
+            while True:
+                receive = asyncio.ensure_future(self.receive(timeout=max(0.0, deadline - time.monotonic())))
+                await asyncio.wait({receive, done}, return_when=asyncio.FIRST_COMPLETED)
+                if not receive.done():
+                    receive.cancel()
+                    return None
+                reply = receive.result()
+                if reply is None or reply.get_metadata('job') == str(job.job_id):
+                    return reply
+                # spóźniona odpowiedź na wcześniejsze zadanie
+        finally:
+            done.cancel()
+
+
+_records = None
+
+
+def _load_records(path):
+    global _records
+    _records = np.load(path, mmap_mode='r')
+
+
+def _compute_costs(population):
+    return cost_function_batch(population, _records).tolist()
+
+
+class ProcessPoolCostBackend(CostBackend):
+    """
+    Computes costs in local processes, one chunk of population per core.
+    Training records are written once to a .npy file which every process maps into memory.
+    """
+
+    def __init__(self, records, max_workers: int = None):
+        self.records = np.asarray(records, dtype=np.float64)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pool = None
+        self.path = None
+
+    async def start(self):
+        fd, self.path = tempfile.mkstemp(suffix='.npy')
+        with os.fdopen(fd, 'wb') as file:
+            np.save(file, self.records)
+        self.pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_load_records, initargs=(self.path,))
+
+    async def compute_costs(self, population):
+        loop = asyncio.get_event_loop()
+        chunks = list(filter(None, tools.split_into_chunks([list(genotype) for genotype in population],
+                                                           self.max_workers)))
+        results = await asyncio.gather(*(loop.run_in_executor(self.pool, _compute_costs, chunk) for chunk in chunks))
+        return list(itertools.chain(*results))
+
+    async def stop(self):
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            # czekanie na procesy w wątku, żeby nie blokować pętli agenta; plik usuwany dopiero po nich
+            await asyncio.get_event_loop().run_in_executor(None, pool.shutdown)
+        if self.path is not None:
+            os.remove(self.path)
+            self.path = None
@@ -1,16 +1,17 @@
-import pandas as pd
 import numpy as np
 
+import tools
+from moving_average import default_cache
 
-def calculate_moving_average(length, records):
-    moving_average = pd.Series(records).rolling(window=length).mean().iloc[length - 1:].values
-    moving_average = np.insert(moving_average, 0, [0] * (length - 1))
-    return moving_average
+# maksymalna liczba elementów macierzy N x len(records) liczonej naraz w cost_function_batch
+BATCH_ELEMENTS = 2 ** 22
 
 
-def cost_function(length_short, length_long, records):
-    mean_short = calculate_moving_average(length_short, records)  # policzenie krótkiej średniej
-    mean_long = calculate_moving_average(length_long, records)  # policzenie długiej średniej
+def cost_function(length_short, length_long, records, cache=None):
+    cache = default_cache if cache is None else cache
+    key = tools.fingerprint(records)
+    mean_short = cache.get(length_short, records, key)  # policzenie krótkiej średniej
+    mean_long = cache.get(length_long, records, key)  # policzenie długiej średniej
     sign = np.sign(
         mean_short - mean_long)  # wyznaczenie gdzie krótka jest wyżej od długiej (1 dla krótkiej większej od długiej, -1 dla długiej większej od krótkiej)
     signals = np.sign(sign[:-1] - sign[1:])  # wyznaczenie punktów przecięcia
@@ -36,3 +37,72 @@ def cost_function(length_short, length_long, records):
     # ax.plot(mean_short)
     # ax.plot(mean_long)
     # plt.show()
+
+
+def _sequential_row_sums(values, mask):
+    """
+    Sums masked values of every row left to right, the same way a python ``for`` loop does.
+    """
+    return np.cumsum(np.where(mask, values, 0.0), axis=1)[:, -1]
+
+
+def _paired_prices(signals, records):
+    """
+    Packs prices of signals to the left of each row. Like in cost_function, a price is every
+    nonzero ``signal * record``, so NaN (and infinite) records are taken even without a signal.
+
+    :param signals: 0/1 signals of shape (N, len(records))
+    :return: (packed prices of shape (N, K), number of selected prices in every row)
+    """
+    prices = signals * records
+    mask = prices != 0
+    counts = mask.sum(axis=1)
+    packed = np.zeros((len(mask), max(int(counts.max(initial=0)), 1)))
+    rows, cols = np.nonzero(mask)
+    ranks = np.cumsum(mask, axis=1)[rows, cols] - 1
+    packed[rows, ranks] = prices[rows, cols]
+    return packed, counts
+
+
+def _cost_function_chunk(params, records, averages, windows):
+    mean_short = averages[np.searchsorted(windows, params[:, 0])]
+    mean_long = averages[np.searchsorted(windows, params[:, 1])]
+    sign = np.sign(mean_short - mean_long)
+    signals = np.zeros_like(sign)
+    signals[:, 1:] = np.sign(sign[:, :-1] - sign[:, 1:])  # punkty przecięcia
+    buys, nbuys = _paired_prices(signals == -1, records)
+    sells, nsells = _paired_prices(signals == 1, records)
+
+    width = min(buys.shape[1], sells.shape[1])
+    npairs = np.minimum(nbuys, nsells)
+    pair_index = np.arange(width)[None, :]
+    used = (pair_index >= 1) & (pair_index < npairs[:, None])  # pierwsza para jest pomijana
+    return _sequential_row_sums(sells[:, :width] - buys[:, :width], used)
+
+
+def cost_function_batch(params, records, cache=None):
+    """
+    Computes cost_function for a whole population at once.
+    Every distinct window length is averaged once (and reused through the cache across calls).
+
+    :param params: array-like of (length_short, length_long) pairs, shape (N, 2)
+    :param records: closing prices
+    :param cache: MovingAverageCache to use (default: moving_average.default_cache)
+    :return: array of N profits, equal to ``[cost_function(s, l, records) for s, l in params]``
+    """
+    cache = default_cache if cache is None else cache
+    params = np.asarray(params, dtype=np.int64).reshape(-1, 2)
+    records = np.asarray(records, dtype=float)
+    if len(params) == 0:
+        return np.zeros(0)
+    if params.min() < 1 or params.max() > len(records):
+        raise ValueError('Moving average lengths must be between 1 and the number of records')
+
+    key = tools.fingerprint(records)
+    windows = np.unique(params)
+    averages = np.stack([cache.get(window, records, key) for window in windows])
+    chunk_size = max(BATCH_ELEMENTS // len(records), 1)
+    return np.concatenate([
+        _cost_function_chunk(params[i:i + chunk_size], records, averages, windows)
+        for i in range(0, len(params), chunk_size)
+    ])
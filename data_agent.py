@@ -1,18 +1,20 @@
 import asyncio
 import itertools
-import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import jsonpickle as jsonpickle
-from aiohttp import ClientConnectorError
+from aiohttp import ClientError
 
 import config
+import metrics
 
 from spade import agent
-from spade.behaviour import OneShotBehaviour, CyclicBehaviour
+from spade.behaviour import OneShotBehaviour, CyclicBehaviour, PeriodicBehaviour
 import tools
-from database import builder
-from database.models import Model, Record
-import aiohttp
+from database.models import Record
+from database.store import AsyncStore, ModelStore, make_store
+from market_data import MarketDataClient, PriceCache
 
 from protocol import request_model_from_db_template, save_model_to_db_template
 
@@ -21,60 +23,132 @@ class DataAgent(agent.Agent):
 
     def __init__(self, jid, password):
         super().__init__(jid, password)
-        self.session = builder.Session()
+        # praca z bazą w osobnych wątkach, żeby nie blokować pętli zdarzeń agenta
+        self.executor = ThreadPoolExecutor(max_workers=config.DB_WORKERS, thread_name_prefix='data_agent_db')
+        self.store = AsyncStore(make_store(), self.executor)
+        self.models = AsyncStore(ModelStore(), self.executor)
+        self.market_data = MarketDataClient()
+        self.prices = PriceCache(self.market_data)
         self.log = tools.make_logger(self.jid)
+        metrics.instrument(self)
+
+    async def _async_stop(self):
+        await super()._async_stop()
+        await self.market_data.close()
 
     async def setup(self):
 
         self.log.debug("Hello World! I'm agent {}".format(str(self.jid)))
 
         history_data_template = tools.create_template("inform", "history")
-        self.add_behaviour(self.HistoryDataBehaviour(self.session), history_data_template)
+        self.add_behaviour(self.HistoryDataBehaviour(self.store), history_data_template)
 
         current_data_template = tools.create_template("inform", "current")
-        self.add_behaviour(self.CurrentDataBehaviour(self.session), current_data_template)
+        self.add_behaviour(self.CurrentDataBehaviour(), current_data_template)
+        self.add_behaviour(self.RefreshPricesBehaviour(period=config.PRICE_REFRESH))
 
         list_models_template = tools.create_template("request", "list")
-        self.add_behaviour(self.ListModelsBehaviour(self.session), list_models_template)
+        self.add_behaviour(self.ListModelsBehaviour(self.models), list_models_template)
 
-        self.add_behaviour(self.GetModelBehaviour(self.session), request_model_from_db_template)
+        self.add_behaviour(self.GetModelBehaviour(self.models), request_model_from_db_template)
 
-        self.add_behaviour(self.SaveModelBehaviour(self.session), save_model_to_db_template)
+        self.add_behaviour(self.SaveModelBehaviour(self.models), save_model_to_db_template)
 
     class HistoryDataBehaviour(CyclicBehaviour):
+        """
+        Serves historical data from the local database.
+        Only ranges missing in the database are downloaded (and saved) before the reply is sent.
+        Every request is handled in its own task, so requests do not wait for each other.
+        """
         "Epoch time dla lat 2014-2019, gdzie pierwszy element to 31.12.2014"
         YEARS = [1419984000, 1451520000, 1483142400, 1514678400, 1546214400, 1577750400]
+        YEAR_LIMIT = 364
+        DAY = 86400
 
-        def __init__(self, session):
+        def __init__(self, store: AsyncStore):
             super().__init__()
-            self.session = session
+            self.store = store
+            self.synced = {}  # waluta -> czas ostatniego pobrania ostatnich dni
+            self.requests = set()  # obsługiwane zapytania
 
         async def run(self):
             message = await self.receive(config.timeout)
             if message is not None:
-                currency, days_amount = jsonpickle.decode(message.body)
-
-                if not days_amount:
-                    self.agent.log.debug(f"Wczytuje dane historyczne dla {currency}")
-                    records = list(await self._get_yearly_currency_data(currency, "PLN", self.YEARS))
-                    if not records:
-                        records = self._get_info_from_db(currency).all()
-                        if not records:
-                            self.agent.log.debug(
-                                "Polaczenie z siecia zawiodlo i nie ma tez zadnego backupu w bazie lub dana waluta nie istnieje")
-                        else:
-                            self.agent.log.debug(f"Sa dane w bazie do wykorzystania")
-                else:
-                    self.agent.log.debug(f"Wczytuje informacje z ostatnich {days_amount} dni dla {currency}")
-                    records = await self._get_last_days_currency_data(currency, "PLN", days_amount)
+                task = asyncio.ensure_future(self._handle(message))
+                self.requests.add(task)
+                task.add_done_callback(self.requests.discard)
 
-                self.agent.log.debug(f"Pobrano {len(records)} wyników dla {currency}")
-                reply = message.make_reply()
-                reply.set_metadata("performative", "reply")
-                reply.set_metadata("what", "historical data")
+        async def _handle(self, message):
+            try:
+                async with metrics.registry.handling(self):
+                    await self._reply(message)
+            except Exception as e:
+                self.agent.log.error(f"Nie udalo sie obsluzyc zapytania o dane historyczne: {e!r}")
+
+        async def _reply(self, message):
+            request = jsonpickle.decode(message.body)
+            currency, days_amount = request[:2]
+            since = request[2] if len(request) > 2 else None  # opcjonalnie tylko dane z czasem > since
+
+            if not days_amount:
+                self.agent.log.debug(f"Wczytuje dane historyczne dla {currency}")
+                start, end = await self._sync_yearly_records(currency)
+            else:
+                self.agent.log.debug(f"Wczytuje informacje z ostatnich {days_amount} dni dla {currency}")
+                start, end = await self._sync_last_days_records(currency, days_amount)
+            if since is not None:
+                start = max(start, since + 1)
+
+            reply = message.make_reply()
+            reply.set_metadata("performative", "reply")
+            reply.set_metadata("what", "historical data")
+            encoding = tools.negotiate_encoding(message.get_metadata("accept-encoding"))
+            if encoding:
+                names = tools.requested_columns(message.get_metadata("columns"))
+                columns = dict(zip(names, await self.store.get_range(currency, start, end, names)))
+                nrecords = len(columns["time"])
+                reply.set_metadata("encoding", encoding)
+                reply.body = tools.encode_columns(columns, encoding)
+            else:
+                records = await self.store.get_records(currency, start, end)
+                nrecords = len(records)
                 reply.body = jsonpickle.dumps(records)
-                await self.send(reply)
-                print(records[::25])
+
+            if not nrecords:
+                self.agent.log.debug(
+                    "Polaczenie z siecia zawiodlo i nie ma tez zadnego backupu w bazie lub dana waluta nie istnieje")
+            self.agent.log.debug(f"Pobrano {nrecords} wyników dla {currency}")
+            await self.send(reply)
+
+        async def _sync_yearly_records(self, currency: str):
+            "pobiera z sieci tylko lata, ktorych brakuje w bazie, zwraca zakres czasu danych treningowych"
+            counts = await asyncio.gather(*(self.store.count(currency, year - self.YEAR_LIMIT * self.DAY, year)
+                                            for year in self.YEARS))
+            missing_years = [year for year, count in zip(self.YEARS, counts) if count <= self.YEAR_LIMIT]
+            if missing_years:
+                self.agent.log.debug(f"Brak w bazie {len(missing_years)} lat dla {currency}, pobieram")
+                records = await self._get_yearly_currency_data(currency, "PLN", missing_years)
+                inserted, updated = await self.store.upsert(records)
+                self.agent.log.debug(f"Zapisano {inserted} nowych i {updated} zaktualizowanych rekordow dla {currency}")
+            return self.YEARS[0] - self.YEAR_LIMIT * self.DAY, self.YEARS[-1]
+
+        async def _sync_last_days_records(self, currency: str, days_amount: int):
+            "pobiera z sieci dni od ostatniego zapisanego (ostatni dzien moze byc niepelny, wiec jest pobierany ponownie)"
+            today = int(time.time()) // self.DAY * self.DAY
+            start = today - (days_amount - 1) * self.DAY
+            if time.time() - self.synced.get(currency, 0) > config.HISTORY_TTL:
+                last = await self.store.last_time(currency)
+                if last is None or last < start or \
+                        await self.store.count(currency, start, last) <= (last - start) // self.DAY:
+                    missing_days = days_amount
+                else:
+                    missing_days = (today - last) // self.DAY + 1
+                self.agent.log.debug(f"Pobieram {missing_days} ostatnich dni dla {currency}")
+                records = await self._get_last_days_currency_data(currency, "PLN", missing_days)
+                if records:
+                    await self.store.upsert(records)
+                    self.synced[currency] = time.time()
+            return start, today
 
         def _create_records(self, currency: str, info: iter):
             return [Record(currency=currency, time=time, high=high, low=low, open=open, close=close)
@@ -89,7 +163,7 @@ class DataAgent(agent.Agent):
             else:
                 return []
 
-        async def _get_historical_data(self, session, fcurr: str, tcurr: str, limit: int, timestamp: int = None):
+        async def _get_historical_data(self, fcurr: str, tcurr: str, limit: int, timestamp: int = None):
             """
             :param fcurr: Poszukiwana waluta
             :param tcurr: Waluta na ktora jest przeliczana
@@ -98,46 +172,29 @@ class DataAgent(agent.Agent):
 
             Jesli chcemy dostac wszystkie wyniki z marca to podajemy ostatni dzien marca i limit na 30
             """
-            if timestamp:
-                url = f"https://min-api.cryptocompare.com/data/v2/histoday?fsym={fcurr}&tsym={tcurr}&toTs={timestamp}&limit={limit}&api_key={config.API_KEY}"
-            else:
-                url = f"https://min-api.cryptocompare.com/data/v2/histoday?fsym={fcurr}&tsym={tcurr}&limit={limit}&api_key={config.API_KEY}"
-            # print(url)
             try:
-                async with session.get(url) as response:
-                    data = json.loads(await response.text())
-                    info = self._retrieve_information(data)
-                    if info:
-                        return self._create_records(fcurr, info)
-                    else:
-                        return []
-            except ClientConnectorError as e:
+                data = await self.agent.market_data.histoday(fcurr, tcurr, limit, timestamp or None)
+                info = self._retrieve_information(data)
+                if info:
+                    return self._create_records(fcurr, info)
+                else:
+                    return []
+            except ClientError as e:
                 self.agent.log.debug("Brak połączenia z siecią!")
                 return []
 
         async def _get_last_days_currency_data(self, fcurr: str, tcurr: str, n: int):
-            async with aiohttp.ClientSession() as session:
-                # przy podaniu n api zwraca n+1 wyników stąd n-1
-                records = await self._get_historical_data(session, fcurr, tcurr, n-1)
-                # print(records)
-                return records
+            # przy podaniu n api zwraca n+1 wyników stąd n-1
+            return await self._get_historical_data(fcurr, tcurr, n-1)
 
         async def _get_yearly_currency_data(self, fcurr: str, tcurr: str, years: iter) -> iter:
             "bierze statystyki z kazdego dnia na przestrzeni lat"
             limit = 364
-            async with aiohttp.ClientSession() as session:
-                tasks = [self._get_historical_data(session, fcurr, tcurr, limit, timestamp) for timestamp in years]
-                records = await asyncio.gather(*tasks)
-                return itertools.chain.from_iterable(records)
-
-        def _get_info_from_db(self, currency):
-            return self.session.query(Record).filter(Record.currency == currency).order_by(Record.time)
+            tasks = [self._get_historical_data(fcurr, tcurr, limit, timestamp) for timestamp in years]
+            records = await asyncio.gather(*tasks)
+            return itertools.chain.from_iterable(records)
 
     class CurrentDataBehaviour(CyclicBehaviour):
-        def __init__(self, session):
-            super().__init__()
-            self.session = session
-
         async def run(self):
             message = await self.receive(config.timeout)
             if message is not None:
@@ -146,39 +203,44 @@ class DataAgent(agent.Agent):
                 value = await self._get_value(currency)
                 self.agent.log.debug(f"Aktualny kurs to {value}")
                 message = tools.create_message("interface_agent@127.0.0.1", "inform", "decision",
-                                               jsonpickle.encode((currency, value)))
+                                               jsonpickle.encode((currency, value)), message.thread)
                 await self.send(message)
 
         async def _get_value(self, fcurr, tcurr="PLN"):
             "Pobiera aktualny kurs waluty"
-            url = f"https://min-api.cryptocompare.com/data/price?fsym={fcurr}&tsyms={tcurr}"
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as response:
-                        data = json.loads(await response.text())
-                        return data.get(tcurr)
-            except ClientConnectorError as e:
+                return await self.agent.prices.get(fcurr, tcurr)
+            except ClientError as e:
                 self.agent.log.debug("Nie ma polaczenia z siecia!")
                 return None
 
+    class RefreshPricesBehaviour(PeriodicBehaviour):
+        "Odswieza w tle kursy ostatnio obserwowanych walut jednym zapytaniem"
+
+        async def run(self):
+            try:
+                await self.agent.prices.refresh_watched()
+            except ClientError as e:
+                self.agent.log.debug(f"Nie udalo sie odswiezyc kursow: {e!r}")
+
     class ListModelsBehaviour(CyclicBehaviour):
 
-        def __init__(self, session):
+        def __init__(self, models: AsyncStore):
             super().__init__()
-            self.session = session
+            self.models = models
 
         async def run(self):
             message = await self.receive(10)
             if message is not None:
-                models_available = self._get_currency_with_models()
+                models_available = await self._get_currency_with_models()
                 self.agent.log.debug(f"Dostępne modele to: {models_available}")
                 message = tools.create_message(str(message.sender), "inform", "list",
-                                               jsonpickle.encode(models_available))
+                                               jsonpickle.encode(models_available), message.thread)
                 await self.send(message)
 
-        def _get_currency_with_models(self) -> iter:
+        async def _get_currency_with_models(self) -> iter:
             "Wyciaga z bazy wszystkie kryptowaluty posiadajace wytrenowane modele"
-            return [row.currency for row in self.session.query(Model).all()]
+            return await self.models.currencies()
 
     class GetModelBehaviour(CyclicBehaviour):
         """
@@ -186,15 +248,15 @@ class DataAgent(agent.Agent):
             Example message.body = "BTC"
         """
 
-        def __init__(self, session):
+        def __init__(self, models: AsyncStore):
             super().__init__()
-            self.session = session
+            self.models = models
 
         async def run(self):
             message = await self.receive(10)
             if message is not None:
                 currency = message.body
-                model = self.session.query(Model).filter(Model.currency == currency).one_or_none()
+                model = await self.models.get_model(currency)
                 reply = message.make_reply()
                 reply.set_metadata("performative", "reply")
                 reply.set_metadata("what", "model")
@@ -218,23 +280,13 @@ class DataAgent(agent.Agent):
             message.body = tools.to_json(model)
         """
 
-        def __init__(self, session):
+        def __init__(self, models: AsyncStore):
             super().__init__()
-            self.session = session
+            self.models = models
 
         async def run(self):
             message = await self.receive(10)
             if message is not None:
                 model = jsonpickle.loads(message.body)
-                self.save_model(model)
+                await self.models.save_model(model)
                 self.agent.log.debug(f"Zapisano model {model.currency}")
-
-        def save_model(self, model):
-            db_model = self.session.query(Model).filter(Model.currency == model.currency).one_or_none()
-            if db_model:
-                db_model.short_mean = model.short_mean
-                db_model.long_mean = model.long_mean
-            else:
-                m = Model(currency=model.currency, long_mean=int(model.long_mean), short_mean=int(model.short_mean))
-                self.session.add(m)
-            self.session.commit()
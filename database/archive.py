@@ -0,0 +1,199 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import List, Iterable, Optional, Tuple, Union, Dict
+
+import numpy as np
+
+from database.models import Record
+from database.store import ROW_COLUMNS, COLUMN_TYPES
+
+
+def _dtype(column: str) -> np.dtype:
+    return np.dtype(COLUMN_TYPES[column]).newbyteorder('<')
+
+
+class ReadWriteLock:
+    """
+    Many readers or one writer. Waiting writer stops new readers from entering, so it is not starved.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._writing and not self._writers_waiting)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._writers_waiting += 1
+            self._condition.wait_for(lambda: not self._writing and not self._readers)
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class ColumnarArchive:
+    """
+    Storage engine keeping one file of packed little-endian values per (currency, column).
+    The time column is sorted and serves as the index of the other columns.
+
+    Columns are read through np.memmap, so a multi-year series is loaded without copying
+    and processes reading the same currency share the same pages of the OS cache.
+    Offers the same data-access methods as RecordStore.
+
+    Reads and writes may come from many threads. Writers are exclusive and readers wait
+    for them, so a read never mixes columns from before and after a write. Views returned by
+    get_range stay valid and unchanged after the read ends: stored values are never changed in place,
+    updates rewrite the files and replace them, and appends only add bytes after the end of the views.
+    Appends write the time column last, so rows whose prices were not fully written are not visible
+    and are truncated before the next append.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._times = {}  # waluta -> zmapowana kolumna czasu
+        self._lock = ReadWriteLock()  # odczyty i zapisy przychodzą z wielu wątków
+
+    def _path(self, currency: str, column: str) -> str:
+        if not currency.isalnum():
+            raise ValueError(f'Invalid currency symbol: {currency!r}')
+        return os.path.join(self.root, currency, f'{column}.bin')
+
+    def _column(self, currency: str, column: str) -> np.ndarray:
+        path = self._path(currency, column)
+        dtype = _dtype(column)
+        length = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+        if not length:
+            return np.empty(0, dtype=dtype)
+        # pełne wartości - niedokończony zapis mógł zostawić część ostatniej
+        return np.memmap(path, dtype=dtype, mode='r', shape=(length,))
+
+    def _time(self, currency: str) -> np.ndarray:
+        times = self._times.get(currency)
+        if times is None:
+            times = self._times[currency] = self._column(currency, 'time')
+        return times
+
+    def _bounds(self, currency: str, start: int = None, end: int = None) -> Tuple[int, int]:
+        times = self._time(currency)
+        first = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+        last = len(times) if end is None else int(np.searchsorted(times, end, side='right'))
+        return first, max(first, last)
+
+    def get_range(self, currency: str, start: int = None, end: int = None,
+                  columns: Tuple[str, ...] = ("close",)) -> Tuple[np.ndarray, ...]:
+        """
+        :return: tuple of read-only views (no copy) of columns of records with start <= time <= end
+        """
+        with self._lock.reading():
+            first, last = self._bounds(currency, start, end)
+            return tuple(self._column(currency, column)[first:last] for column in columns)
+
+    def get_records(self, currency: str, start: int = None, end: int = None) -> List[Record]:
+        columns = self.get_range(currency, start, end, ROW_COLUMNS)
+        return [Record(currency=currency, **{name: value.item() for name, value in zip(ROW_COLUMNS, row)})
+                for row in zip(*columns)]
+
+    def count(self, currency: str, start: int = None, end: int = None) -> int:
+        with self._lock.reading():
+            first, last = self._bounds(currency, start, end)
+        return last - first
+
+    def last_time(self, currency: str) -> Optional[int]:
+        with self._lock.reading():
+            times = self._time(currency)
+            return int(times[-1]) if len(times) else None
+
+    def upsert(self, records: Iterable) -> Tuple[int, int]:
+        by_currency = {}
+        for record in records:
+            row = tuple(getattr(record, column) for column in ROW_COLUMNS)
+            by_currency.setdefault(record.currency, []).append(row)
+
+        inserted, updated = 0, 0
+        for currency, rows in by_currency.items():
+            currency_inserted, currency_updated = self.bulk_upsert(currency, rows)
+            inserted += currency_inserted
+            updated += currency_updated
+        return inserted, updated
+
+    def bulk_upsert(self, currency: str, data: Union[Iterable[tuple], Dict[str, Iterable]],
+                    chunk_size: int = None) -> Tuple[int, int]:
+        """
+        Inserts or updates records of one currency.
+        Records newer than the last stored one are appended, stored or older ones cause
+        the columns of the currency to be rewritten.
+
+        :param data: rows of (time, high, low, open, close) or dict of columns with these names
+        :param chunk_size: unused, kept for compatibility with RecordStore
+        :return: (number of inserted rows, number of updated rows)
+        """
+        if isinstance(data, dict):
+            data = zip(*(data[column] for column in ROW_COLUMNS))
+        rows = {int(row[0]): row for row in data}  # przy powtórzeniach wygrywa ostatni
+        if not rows:
+            return 0, 0
+        with self._lock.writing():
+            return self._bulk_upsert(currency, rows)
+
+    def _bulk_upsert(self, currency: str, rows: Dict[int, tuple]) -> Tuple[int, int]:
+        new = {column: np.array([row[i] for _, row in sorted(rows.items())], dtype=COLUMN_TYPES[column])
+               for i, column in enumerate(ROW_COLUMNS)}
+
+        times = self._time(currency)
+        positions = np.searchsorted(times, new['time'])
+        stored = (positions < len(times)) & (times[np.minimum(positions, len(times) - 1)] == new['time']) \
+            if len(times) else np.zeros(len(new['time']), dtype=bool)
+        os.makedirs(os.path.join(self.root, currency), exist_ok=True)
+
+        appended = ~stored
+        if not stored.any() and (not len(times) or new['time'][0] > times[-1]):
+            self._append(currency, len(times), new)
+        else:
+            self._rewrite(currency, positions[stored], {column: new[column][stored] for column in ROW_COLUMNS},
+                          {column: new[column][appended] for column in ROW_COLUMNS})
+        self._times.pop(currency, None)
+        return int(appended.sum()), int(stored.sum())
+
+    def _append(self, currency: str, length: int, new: Dict[str, np.ndarray]):
+        # kolumna czasu na końcu, żeby czytelnicy nie widzieli wierszy bez cen
+        for column in ROW_COLUMNS[1:] + ROW_COLUMNS[:1]:
+            path = self._path(currency, column)
+            with open(path, 'ab') as file:
+                # nadmiarowe wartości po przerwanym dopisywaniu nie mają wierszy w kolumnie czasu
+                file.truncate(length * _dtype(column).itemsize)
+                file.write(new[column].astype(_dtype(column)).tobytes())
+
+    def _rewrite(self, currency: str, positions: np.ndarray, updated: Dict[str, np.ndarray],
+                 appended: Dict[str, np.ndarray]):
+        "nowe pliki kolumn zastępują stare, więc widoki wydane przez get_range się nie zmieniają"
+        times = self._time(currency)
+        order = np.argsort(np.concatenate([times, appended['time']]), kind='stable')
+        for column in ROW_COLUMNS[1:] + ROW_COLUMNS[:1]:
+            values = np.array(self._column(currency, column)[:len(times)])
+            values[positions] = updated[column]
+            merged = np.concatenate([values, appended[column]])[order]
+            path = self._path(currency, column)
+            with open(path + '.tmp', 'wb') as file:
+                file.write(merged.astype(_dtype(column)).tobytes())
+            os.replace(path + '.tmp', path)
@@ -1,18 +1,64 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 
 import config
 from database import models
 
 DB_PATH = config.DB_PATH
-DB = f'sqlite:///{DB_PATH}crypto.db'
-ENGINE = create_engine(DB)
+DB_FILE = f'{DB_PATH}crypto.db'
+DB = f'sqlite:///{DB_FILE}'
+
+
+def make_engine(path: str = DB_FILE, read_only: bool = False, pool_size: int = None) -> Engine:
+    """
+    Creates engine of the SQLite database with settings from config.
+
+    Every new connection gets journal mode, synchronous, cache_size, mmap_size and busy timeout PRAGMAs.
+    Connections are pooled and may be used by any thread (one session at a time).
+
+    :param path: path of the database file
+    :param read_only: open the database read-only (replica engine for agents that only query)
+    :param pool_size: number of pooled connections, by default config.DB_POOL_SIZE
+    """
+    if read_only:
+        url = f'sqlite:///file:{path}?mode=ro&uri=true'
+    else:
+        url = f'sqlite:///{path}'
+    engine = create_engine(url, poolclass=QueuePool,
+                           pool_size=pool_size if pool_size is not None else config.DB_POOL_SIZE,
+                           connect_args=dict(check_same_thread=False, timeout=config.DB_BUSY_TIMEOUT))
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if read_only:
+            cursor.execute('PRAGMA query_only=ON')
+        else:
+            # tryb dziennika zapisuje się w pliku bazy, połączenie tylko do odczytu go nie zmieni
+            cursor.execute(f'PRAGMA journal_mode={config.DB_JOURNAL_MODE}')
+        cursor.execute(f'PRAGMA synchronous={config.DB_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA cache_size={int(config.DB_CACHE_SIZE)}')
+        cursor.execute(f'PRAGMA mmap_size={int(config.DB_MMAP_SIZE)}')
+        cursor.execute(f'PRAGMA busy_timeout={int(config.DB_BUSY_TIMEOUT * 1000)}')
+        cursor.close()
+
+    return engine
+
+
+ENGINE = make_engine()
+READ_ENGINE = make_engine(read_only=True)
 session_factory = sessionmaker(bind=ENGINE)
+read_session_factory = sessionmaker(bind=READ_ENGINE)
 Session = scoped_session(session_factory)
 
 
 def create_db():
     models.Base.metadata.create_all(ENGINE)
+    # create_all nie dodaje indeksów do istniejących już tabel
+    for index in models.Record.__table__.indexes:
+        index.create(ENGINE, checkfirst=True)
 
 
 if __name__ == '__main__':
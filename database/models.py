@@ -1,5 +1,5 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Integer, Column, String, Float, UniqueConstraint
+from sqlalchemy import Integer, Column, String, Float, UniqueConstraint, Index
 import datetime
 
 Base = declarative_base()
@@ -16,7 +16,9 @@ class Record(Base):
     open = Column(Float)
     close = Column(Float)
 
-    __table_args__ = (UniqueConstraint('currency', 'time', name='_currency_time_uc_'),)
+    # indeks pokrywający zapytania o zakres czasu zwracające ceny zamknięcia
+    __table_args__ = (UniqueConstraint('currency', 'time', name='_currency_time_uc_'),
+                      Index('_currency_time_close_ix_', 'currency', 'time', 'close'))
 
     def __repr__(self):
         return f"{self.id} {self.currency} {datetime.datetime.fromtimestamp(self.time)} {self.high}"
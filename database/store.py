@@ -0,0 +1,224 @@
+import asyncio
+import functools
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from typing import List, Iterable, Optional, Tuple, Union, Dict
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert
+
+import config
+from database import builder
+from database.models import Record, Model
+
+PRICE_COLUMNS = ("high", "low", "open", "close")
+"kolejność pól w krotkach przyjmowanych przez bulk_upsert (taka jak zwraca API)"
+ROW_COLUMNS = ("time",) + PRICE_COLUMNS
+UPSERT_CHUNK_SIZE = 500
+COLUMN_TYPES = {"time": np.int64, "high": np.float64, "low": np.float64, "open": np.float64, "close": np.float64}
+
+
+class SessionStore:
+    """
+    Base of data-access objects of the local database.
+    Every call works in its own session, which is committed or rolled back at the end.
+    Queries use sessions of the read-only engine, so they do not take connections of the writer.
+    """
+
+    def __init__(self, session_factory=None, read_session_factory=None):
+        self.session_factory = session_factory if session_factory is not None else builder.session_factory
+        if read_session_factory is None:
+            # bez osobnej fabryki zapisu, odczyty idą tą samą drogą
+            read_session_factory = builder.read_session_factory if session_factory is None else session_factory
+        self.read_session_factory = read_session_factory
+
+    @contextmanager
+    def session_scope(self, read_only: bool = False):
+        session = self.read_session_factory() if read_only else self.session_factory()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+class RecordStore(SessionStore):
+    """
+    Access to historical records kept in the local database.
+    """
+
+    def get_records(self, currency: str, start: int = None, end: int = None) -> List[Record]:
+        """
+        :return: records of currency with start <= time <= end, ordered by time
+        """
+        with self.session_scope(read_only=True) as session:
+            query = self._filter(session.query(Record), currency, start, end)
+            records = query.order_by(Record.time).all()
+            session.expunge_all()
+            return records
+
+    def get_range(self, currency: str, start: int = None, end: int = None,
+                  columns: Tuple[str, ...] = ("close",)) -> Tuple[np.ndarray, ...]:
+        """
+        Reads chosen columns of records with start <= time <= end, ordered by time.
+        Filtering and projection are done in SQL, no ORM objects are created.
+
+        :return: tuple of arrays, one for every column
+        """
+        table = Record.__table__
+        statement = self._filter_table(select(*(table.c[name] for name in columns)), currency, start, end)
+        with self.session_scope(read_only=True) as session:
+            rows = session.execute(statement.order_by(table.c.time)).fetchall()
+        if not rows:
+            return tuple(np.empty(0, dtype=COLUMN_TYPES[name]) for name in columns)
+        return tuple(np.array(values, dtype=COLUMN_TYPES[name]) for name, values in zip(columns, zip(*rows)))
+
+    def count(self, currency: str, start: int = None, end: int = None) -> int:
+        with self.session_scope(read_only=True) as session:
+            return self._filter(session.query(func.count(Record.id)), currency, start, end).scalar()
+
+    def last_time(self, currency: str) -> Optional[int]:
+        with self.session_scope(read_only=True) as session:
+            return session.query(func.max(Record.time)).filter(Record.currency == currency).scalar()
+
+    def upsert(self, records: Iterable) -> Tuple[int, int]:
+        """
+        Inserts records or updates prices of the ones already stored (unique on currency and time).
+
+        :param records: objects with currency, time, high, low, open and close attributes
+        :return: (number of inserted rows, number of updated rows)
+        """
+        by_currency = {}
+        for record in records:
+            row = tuple(getattr(record, column) for column in ROW_COLUMNS)
+            by_currency.setdefault(record.currency, []).append(row)
+
+        inserted, updated = 0, 0
+        for currency, rows in by_currency.items():
+            currency_inserted, currency_updated = self.bulk_upsert(currency, rows)
+            inserted += currency_inserted
+            updated += currency_updated
+        return inserted, updated
+
+    def bulk_upsert(self, currency: str, data: Union[Iterable[tuple], Dict[str, Iterable]],
+                    chunk_size: int = UPSERT_CHUNK_SIZE) -> Tuple[int, int]:
+        """
+        Inserts or updates many records of one currency in a single transaction,
+        using chunked executemany of INSERT ... ON CONFLICT DO UPDATE. Safe to re-run.
+
+        :param currency: currency of all records
+        :param data: rows of (time, high, low, open, close) or dict of columns with these names
+        :param chunk_size: number of rows per executemany batch
+        :return: (number of inserted rows, number of updated rows)
+        """
+        if isinstance(data, dict):
+            data = zip(*(data[column] for column in ROW_COLUMNS))
+        rows = {}  # czas -> wiersz, przy powtórzeniach wygrywa ostatni
+        for row in data:
+            rows[int(row[0])] = dict(currency=currency, time=int(row[0]),
+                                     **{column: float(value) for column, value in zip(PRICE_COLUMNS, row[1:])})
+        rows = list(rows.values())
+
+        table = Record.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=["currency", "time"],
+            set_={column: statement.excluded[column] for column in PRICE_COLUMNS})
+        inserted, updated = 0, 0
+        with self.session_scope() as session:
+            for i in range(0, len(rows), chunk_size):
+                chunk = rows[i:i + chunk_size]
+                existing = session.execute(
+                    select(func.count()).select_from(table).where(
+                        table.c.currency == currency, table.c.time.in_([row["time"] for row in chunk]))).scalar()
+                session.execute(statement, chunk)
+                updated += existing
+                inserted += len(chunk) - existing
+        return inserted, updated
+
+    @staticmethod
+    def _filter(query, currency, start, end):
+        query = query.filter(Record.currency == currency)
+        if start is not None:
+            query = query.filter(Record.time >= start)
+        if end is not None:
+            query = query.filter(Record.time <= end)
+        return query
+
+    @staticmethod
+    def _filter_table(statement, currency, start, end):
+        table = Record.__table__
+        statement = statement.where(table.c.currency == currency)
+        if start is not None:
+            statement = statement.where(table.c.time >= start)
+        if end is not None:
+            statement = statement.where(table.c.time <= end)
+        return statement
+
+
+class ModelStore(SessionStore):
+    """
+    Access to trained models kept in the local database.
+    """
+
+    def currencies(self) -> List[str]:
+        "waluty, dla ktorych sa wytrenowane modele"
+        with self.session_scope(read_only=True) as session:
+            return [currency for currency, in session.query(Model.currency).all()]
+
+    def get_model(self, currency: str) -> Optional[Model]:
+        with self.session_scope(read_only=True) as session:
+            model = session.query(Model).filter(Model.currency == currency).one_or_none()
+            session.expunge_all()
+            return model
+
+    def save_model(self, model):
+        """
+        Inserts model or updates means of the model of its currency.
+        """
+        with self.session_scope() as session:
+            db_model = session.query(Model).filter(Model.currency == model.currency).one_or_none()
+            if db_model:
+                db_model.short_mean = int(model.short_mean)
+                db_model.long_mean = int(model.long_mean)
+            else:
+                session.add(Model(currency=model.currency, long_mean=int(model.long_mean),
+                                  short_mean=int(model.short_mean)))
+
+
+class AsyncStore:
+    """
+    Asynchronous facade of a synchronous store (RecordStore, ColumnarArchive, ModelStore).
+    Every method of the store is awaited, while the call runs on the executor, so database work
+    does not block the event loop and independent calls run in parallel.
+    """
+
+    def __init__(self, store, executor: Executor):
+        self.store = store
+        self.executor = executor
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+
+        return call
+
+
+def make_store():
+    """
+    Creates data-access object of the storage engine chosen in config.STORAGE_ENGINE.
+    """
+    if getattr(config, 'STORAGE_ENGINE', 'sqlite') == 'archive':
+        from database.archive import ColumnarArchive
+        return ColumnarArchive(config.ARCHIVE_PATH)
+    return RecordStore()
@@ -1,12 +1,14 @@
-import asyncio
+import time
 
 import jsonpickle
 from spade import agent
-from spade.behaviour import CyclicBehaviour, OneShotBehaviour
+from spade.behaviour import CyclicBehaviour, OneShotBehaviour, PeriodicBehaviour
+from spade.template import Template
 
+import metrics
 import protocol
 import tools
-from strategy_agent import StrategyAgent
+from strategy_pool import StrategyAgentPool
 import config
 
 
@@ -14,7 +16,14 @@ class DecisionAgent(agent.Agent):
     def __init__(self, jid, password, verify_security=False):
         super().__init__(jid, password, verify_security)
         self.log = tools.make_logger(self.jid)
-        self.strategy_agents = set()
+        self.strategy_agents = StrategyAgentPool(str(self.jid), log=self.log)
+        self.prewarm_thread = tools.make_uuid()
+        self.ready = set()  # waluty, których agenci strategii odpowiadają na zapytania
+        self.decisions = {}  # waluta -> ostatnia decyzja agenta strategii
+        self.waiting = {}  # waluta -> [(wątek, termin)] zapytań interfejsu czekających na decyzję
+        self.querying = {}  # waluta -> (wątek, termin odpowiedzi) zapytania wysłanego do agenta strategii
+        self.stale = set()  # waluty, dla których odpowiedź w drodze jest już nieaktualna
+        metrics.instrument(self)
 
     async def setup(self):
         self.log.info('Starting!')
@@ -29,14 +38,62 @@ class DecisionAgent(agent.Agent):
         decision_request_template = tools.create_template("request", "decision")
         self.add_behaviour(self.DecisionBehaviour(), decision_request_template)
         self.add_behaviour(self.DecisionResponseBehaviour(), protocol.give_decision_template)
+        self.add_behaviour(self.StrategyReadyBehaviour(), protocol.strategy_ready_template)
+        self.add_behaviour(self.QueryTimeoutBehaviour(period=config.DECISION_QUERY_CHECK))
 
-    async def ensure_strategy_agent(self, currency_symbol):
-        jid = f'{currency_symbol}@{config.domain}'
+        if config.PREWARM_STRATEGIES:
+            self.add_behaviour(self.PrewarmBehaviour(),
+                               Template(thread=self.prewarm_thread, metadata=list_response_template.metadata))
+        self.add_behaviour(self.EvictIdleBehaviour(period=config.STRATEGY_EVICT_PERIOD))
 
-        if jid not in self.strategy_agents:
-            strategy_agent = StrategyAgent(jid, currency_symbol, currency_symbol)
-            await strategy_agent.start(auto_register=True)
-            self.strategy_agents.add(jid)
+    async def ensure_strategy_agent(self, currency_symbol):
+        await self.strategy_agents.ensure(currency_symbol)
+
+    async def stop_strategy_agent(self, currency_symbol):
+        "zatrzymuje agenta strategii i zapomina wszystko, co o nim wiadomo"
+        await self.strategy_agents.evict(currency_symbol)
+        self.ready.discard(currency_symbol)
+        self.decisions.pop(currency_symbol, None)
+        self.querying.pop(currency_symbol, None)
+        self.stale.discard(currency_symbol)
+
+    def decision_query(self, currency):
+        """
+        Creates request for decision of currency's strategy agent, unless one is already on its way
+        or the agent is not ready yet (then the request is made when it says it is ready).
+
+        :return: message to send or None
+        """
+        if currency not in self.waiting or currency in self.querying or currency not in self.ready:
+            return None
+        thread = tools.make_uuid()
+        self.querying[currency] = (thread, time.monotonic() + config.DECISION_QUERY_TIMEOUT)
+        return tools.message_from_template(protocol.request_decision_template,
+                                          to=f'{currency}@{config.domain}', thread=thread)
+
+    def decision_answers(self, currency, answer):
+        """
+        :return: messages with decision for all interface requests waiting for currency
+        """
+        return [decision_message(currency, answer, thread) for thread, _ in self.waiting.pop(currency, [])]
+
+    def expired_answers(self, now):
+        """
+        Interface requests waiting longer than DECISION_WAIT_TIMEOUT (the strategy agent is still training
+        or its training failed) are answered 'not available'.
+
+        :return: messages for expired requests
+        """
+        messages = []
+        for currency, entries in list(self.waiting.items()):
+            messages += [decision_message(currency, 'not available', thread)
+                         for thread, deadline in entries if deadline <= now]
+            entries = [(thread, deadline) for thread, deadline in entries if deadline > now]
+            if entries:
+                self.waiting[currency] = entries
+            else:
+                del self.waiting[currency]
+        return messages
 
     class TrainBehaviour(CyclicBehaviour):
         async def run(self):
@@ -49,14 +106,15 @@ class DecisionAgent(agent.Agent):
         async def run(self):
             models_request = await self.receive(config.timeout)
             if models_request:
-                da_request = tools.create_message(f"data_agent@{config.domain}", "request", "list", "")
+                da_request = tools.create_message(f"data_agent@{config.domain}", "request", "list", "",
+                                                  thread=models_request.thread)
                 self.agent.log.debug(f'{models_request.sender} is asking for list of models, asking {da_request.to}')
                 await self.send(da_request)
 
     class ListResponseBehaviour(CyclicBehaviour):
         async def run(self):
             da_response = await self.receive(config.timeout)
-            if da_response is not None:
+            if da_response is not None and da_response.thread != self.agent.prewarm_thread:
                 models = da_response.body
                 try:
                     parsed_models = jsonpickle.decode(da_response.body)
@@ -68,26 +126,43 @@ class DecisionAgent(agent.Agent):
 
                     self.agent.log.debug(
                         f'{da_response.sender} responded, {nmodels} models available. Informing interface.')
-                    models_list = tools.create_message(f"interface_agent@{config.domain}", "inform", "list", models)
+                    models_list = tools.create_message(f"interface_agent@{config.domain}", "inform", "list", models,
+                                                      thread=da_response.thread)
                     await self.send(models_list)
                 except:
                     self.agent.log.error(
                         f'List of models from {da_response.sender} is invalid. No models available.')
                     models = jsonpickle.encode(None)
-                    models_list = tools.create_message(f"interface_agent@{config.domain}", "inform", "list", models)
+                    models_list = tools.create_message(f"interface_agent@{config.domain}", "inform", "list", models,
+                                                      thread=da_response.thread)
                     await self.send(models_list)
 
     class DecisionBehaviour(CyclicBehaviour):
+        """
+        Answers from cache when possible, otherwise joins the request to the one already
+        sent to the strategy agent (or sends it if the agent is ready).
+        """
+
         async def run(self):
             message = await self.receive(config.timeout)
             if message is not None:
                 currency = message.body.lower()
-                request = tools.message_from_template(protocol.request_decision_template,
-                                                      to=f'{currency}@{config.domain}')
-                self.agent.log.info(f'{message.sender} is asking for decision, asking {request.to} for an answer')
+                deadline = time.monotonic() + config.DECISION_WAIT_TIMEOUT
+                self.agent.waiting.setdefault(currency, []).append((message.thread, deadline))
+                self.agent.strategy_agents.touch(currency)
+                if currency in self.agent.decisions:
+                    self.agent.log.info(f'{message.sender} is asking for decision, answering from cache')
+                    for response_to_interface in self.agent.decision_answers(currency, self.agent.decisions[currency]):
+                        await self.send(response_to_interface)
+                    return
+
                 await self.agent.ensure_strategy_agent(currency)
-                await asyncio.sleep(5)
-                await self.send(request)
+                request = self.agent.decision_query(currency)
+                if request is not None:
+                    self.agent.log.info(f'{message.sender} is asking for decision, asking {request.to} for an answer')
+                    await self.send(request)
+                else:
+                    self.agent.log.info(f'{message.sender} is asking for decision, waiting for {currency}')
 
     class DecisionResponseBehaviour(CyclicBehaviour):
         async def run(self):
@@ -96,12 +171,80 @@ class DecisionAgent(agent.Agent):
                 answer = message.metadata['answer']
                 self.agent.log.info(f'{message.sender} says "{answer}"')
                 currency = str(message.sender).split('@')[0]  # to bardzo brzydki trick
-                body = jsonpickle.encode([currency, message.metadata['answer']])
-                response_to_interface = tools.create_message(to=f'interface_agent@{config.domain}', performative='inform',
-                                                             ontology='decision', body=body)
-                await self.send(response_to_interface)
+                thread, _ = self.agent.querying.get(currency, (None, None))
+                if message.thread != thread:
+                    self.agent.log.info(f'Answer of {message.sender} came after the deadline, ignoring it')
+                    return
+                del self.agent.querying[currency]
+                if answer != 'not available' and currency not in self.agent.stale:
+                    self.agent.decisions[currency] = answer
+                self.agent.stale.discard(currency)
+                for response_to_interface in self.agent.decision_answers(currency, answer):
+                    await self.send(response_to_interface)
                 self.agent.log.info('Decision sent to interface!')
 
+    class PrewarmBehaviour(OneShotBehaviour):
+        "uruchamia agentow strategii dla wszystkich walut, ktore maja zapisany model"
+
+        async def run(self):
+            request = tools.create_message(f"data_agent@{config.domain}", "request", "list", "",
+                                           thread=self.agent.prewarm_thread)
+            await self.send(request)
+            response = await self.receive(config.timeout)
+            if response is None:
+                self.agent.log.error('List of models not arrived, strategy agents are not prewarmed')
+                return
+            currencies = jsonpickle.decode(response.body) or []
+            started = await self.agent.strategy_agents.prewarm(currency.lower() for currency in currencies)
+            self.agent.log.info(f'Prewarmed {len(started)} strategy agents')
+
+    class EvictIdleBehaviour(PeriodicBehaviour):
+        async def run(self):
+            for currency in self.agent.strategy_agents.idle():
+                if currency in self.agent.waiting:
+                    continue
+                self.agent.log.info(f'Strategy agent of {currency} is idle, stopping it')
+                await self.agent.stop_strategy_agent(currency)
+
+    class QueryTimeoutBehaviour(PeriodicBehaviour):
+        """
+        Zapytania bez odpowiedzi w terminie - czekajacy dostaja 'not available', kolejne zapytania ida od nowa.
+        Tak samo zapytania interfejsu czekajace za dlugo na gotowosc agenta strategii.
+        """
+
+        async def run(self):
+            now = time.monotonic()
+            for currency in [currency for currency, (_, deadline) in self.agent.querying.items() if deadline <= now]:
+                self.agent.log.error(f'Strategy agent of {currency} did not answer in time')
+                del self.agent.querying[currency]  # spóźniona odpowiedź zostanie zignorowana
+                self.agent.stale.discard(currency)
+                for response_to_interface in self.agent.decision_answers(currency, 'not available'):
+                    await self.send(response_to_interface)
+            for response_to_interface in self.agent.expired_answers(now):
+                await self.send(response_to_interface)
+
+    class StrategyReadyBehaviour(CyclicBehaviour):
+        "agent strategii jest gotowy albo zmienil model lub dane - decyzja w cache jest nieaktualna"
+
+        async def run(self):
+            message = await self.receive(config.timeout)
+            if message is not None:
+                currency = str(message.sender).split('@')[0]
+                self.agent.log.info(f'{message.sender} is ready')
+                self.agent.ready.add(currency)
+                self.agent.decisions.pop(currency, None)
+                if currency in self.agent.querying:
+                    self.agent.stale.add(currency)
+                request = self.agent.decision_query(currency)
+                if request is not None:
+                    await self.send(request)
+
+
+def decision_message(currency, answer, thread):
+    body = jsonpickle.encode([currency, answer])
+    return tools.create_message(to=f'interface_agent@{config.domain}', performative='inform',
+                                ontology='decision', body=body, thread=thread)
+
 
 if __name__ == '__main__':
     agent = DecisionAgent('decision_agent@localhost', 'decision_agent')
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+
+import websockets
+
+import tools
+
+
+class WebSocketGateway:
+    """
+    Keeps track of all connected websockets and routes agent replies to the connection that asked.
+
+    Every request sent to agents gets a correlation id (message thread), agents keep the thread
+    in their replies and the gateway uses it to find the originating connection.
+    Sockets are written in the event loop they were accepted in, even if replies arrive
+    in the agent's loop.
+    """
+
+    def __init__(self, log: logging.Logger):
+        self.log = log
+        self.connections = {}  # websocket -> pętla zdarzeń, w której działa
+        self.requests = {}  # id zapytania -> websocket
+
+    def register(self, websocket):
+        self.connections[websocket] = asyncio.get_event_loop()
+        self.log.debug(f'Websocket connected, {len(self.connections)} connections')
+
+    def unregister(self, websocket):
+        self.connections.pop(websocket, None)
+        # reply zdejmuje zapytania w pętli agenta (innym wątku) - iteracja po kopii, usuwanie bez wyjątku
+        for request_id, owner in list(self.requests.items()):
+            if owner is websocket:
+                self.requests.pop(request_id, None)
+        self.log.debug(f'Websocket disconnected, {len(self.connections)} connections')
+
+    def track(self, websocket) -> str:
+        """
+        :return: correlation id to use as thread of messages sent on behalf of the websocket
+        """
+        request_id = tools.make_uuid()
+        self.requests[request_id] = websocket
+        return request_id
+
+    async def reply(self, request_id: str, text: str) -> bool:
+        """
+        Sends reply to the connection that made request with given id.
+
+        :return: True if reply was delivered
+        """
+        websocket = self.requests.pop(request_id, None)
+        if websocket is None:
+            self.log.debug(f'No connection waits for reply to {request_id}, dropping it')
+            return False
+        return await self.send(websocket, text)
+
+    async def send(self, websocket, text: str) -> bool:
+        loop = self.connections.get(websocket)
+        if loop is None:
+            return False
+        try:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(websocket.send(text), loop))
+            return True
+        except websockets.ConnectionClosed:
+            self.unregister(websocket)
+            return False
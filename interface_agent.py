@@ -1,12 +1,16 @@
 import jsonpickle
+import websockets
+from aiohttp import web
 from spade import agent
 from spade.behaviour import OneShotBehaviour, CyclicBehaviour
 
 import config
+import metrics
 import response
 import tools
 from data_agent import DataAgent
 from decision_agent import DecisionAgent
+from gateway import WebSocketGateway
 
 
 class InterfaceAgent(agent.Agent):
@@ -14,50 +18,61 @@ class InterfaceAgent(agent.Agent):
     def __init__(self, jid, passwd):
         super().__init__(jid, passwd)
         self.log = tools.make_logger(self.jid)
-        self.receiver = None
+        self.gateway = WebSocketGateway(self.log)
+        metrics.instrument(self)
 
     async def hello(self, websocket, path):
-        self.receiver = websocket
-        async for message in websocket:
-            request = jsonpickle.decode(message)
-            if request['action'] == 'list':
-                resp = await self.list_handler()
-            elif request['action'] == 'decision':
-                symbol = str.lower(request['body'])
-                resp = await self.decision_handler(symbol)
-            elif request['action'] == 'train':
-                symbol = str.lower(request['body'])
-                resp = await self.train_handler(symbol)
-            else:
-                resp = response.Response()
-                resp.body = 'Bad request'
-                resp.status = response.Status.FAIL
-            await websocket.send(resp.get_json())
+        self.gateway.register(websocket)
+        try:
+            async for message in websocket:
+                request = jsonpickle.decode(message)
+                if request['action'] == 'list':
+                    resp = await self.list_handler(websocket)
+                elif request['action'] == 'decision':
+                    symbol = str.lower(request['body'])
+                    resp = await self.decision_handler(websocket, symbol)
+                elif request['action'] == 'train':
+                    symbol = str.lower(request['body'])
+                    resp = await self.train_handler(websocket, symbol)
+                else:
+                    resp = response.Response()
+                    resp.body = 'Bad request'
+                    resp.status = response.Status.FAIL
+                await websocket.send(resp.get_json())
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.gateway.unregister(websocket)
 
-    async def list_handler(self):
+    async def list_handler(self, websocket):
         resp = response.Response.basic_response()
         resp.type = response.Type.LIST
-        request_list_behaviour = self.RequestListBehaviour()
+        request_list_behaviour = self.RequestListBehaviour(self.gateway.track(websocket))
         self.add_behaviour(request_list_behaviour)
         return resp
 
-    async def decision_handler(self, symbol):
+    async def decision_handler(self, websocket, symbol):
         resp = response.Response.basic_response()
         resp.type = response.Type.DECISION
-        decision_behaviour = self.RequestDecisionBehaviour(symbol)
+        decision_behaviour = self.RequestDecisionBehaviour(symbol, self.gateway.track(websocket))
         self.add_behaviour(decision_behaviour)
         return resp
 
-    async def train_handler(self, symbol):
+    async def train_handler(self, websocket, symbol):
         resp = response.Response.basic_response()
         resp.type = response.Type.TRAIN
-        train_behaviour = self.RequestTrainBehaviour(symbol)
+        # na zlecenie treningu żaden agent nie odpowiada, więc nie jest śledzone w bramce
+        train_behaviour = self.RequestTrainBehaviour(symbol, tools.make_uuid())
         self.add_behaviour(train_behaviour)
         return resp
 
     async def main_controller(self, request):
         return {}
 
+    async def metrics_controller(self, request):
+        "metryki zachowań wszystkich agentów w procesie, w formacie tekstowym Prometheusa"
+        return web.Response(body=metrics.registry.expose().encode(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
     async def spawn_agents(self):
         data_agent = DataAgent("data_agent@127.0.0.1", "data_agent")
         await data_agent.start(auto_register=False)
@@ -68,6 +83,8 @@ class InterfaceAgent(agent.Agent):
         self.log.debug("Hello World! I'm agent {}".format(str(self.jid)))
         self.web.start(port=10000, templates_path="static/templates")
         self.web.add_get("", self.main_controller, "main.html")
+        if config.METRICS:
+            self.web.add_get("/metrics", self.metrics_controller, None, raw=True)
 
         decision_template = tools.create_template("inform", "decision")
         self.add_behaviour(self.ResponseDecisionBehaviour(), decision_template)
@@ -80,26 +97,32 @@ class InterfaceAgent(agent.Agent):
 
     class RequestTrainBehaviour(OneShotBehaviour):
 
-        def __init__(self, symbol):
+        def __init__(self, symbol, thread):
             super().__init__()
             self.symbol = symbol
+            self.thread = thread
 
         async def run(self):
-            message = tools.create_message("decision_agent@127.0.0.1", "inform", "train", self.symbol)
+            message = tools.create_message("decision_agent@127.0.0.1", "inform", "train", self.symbol, self.thread)
             await self.send(message)
 
     class RequestListBehaviour(OneShotBehaviour):
+        def __init__(self, thread):
+            super().__init__()
+            self.thread = thread
+
         async def run(self):
-            message = tools.create_message("decision_agent@127.0.0.1", "request", "list", "list")
+            message = tools.create_message("decision_agent@127.0.0.1", "request", "list", "list", self.thread)
             await self.send(message)
 
     class RequestDecisionBehaviour(OneShotBehaviour):
-        def __init__(self, symbol):
+        def __init__(self, symbol, thread):
             super().__init__()
             self.symbol = symbol
+            self.thread = thread
 
         async def run(self):
-            message = tools.create_message("decision_agent@127.0.0.1", "request", "decision", self.symbol)
+            message = tools.create_message("decision_agent@127.0.0.1", "request", "decision", self.symbol, self.thread)
             await self.send(message)
 
     class ResponseDecisionBehaviour(CyclicBehaviour):
@@ -120,7 +143,7 @@ class InterfaceAgent(agent.Agent):
                     resp.body = f"{currency} - {value}"
                 resp.type = response.Type.DECISION
                 self.agent.log.debug(resp)
-                await self.agent.receiver.send(resp.get_json())
+                await self.agent.gateway.reply(message.thread, resp.get_json())
 
     class ResponseListBehaviour(CyclicBehaviour):
 
@@ -135,7 +158,7 @@ class InterfaceAgent(agent.Agent):
                 resp.status = response.Status.DONE
                 resp.type = response.Type.LIST
                 self.agent.log.debug(resp)
-                await self.agent.receiver.send(resp.get_json())
+                await self.agent.gateway.reply(message.thread, resp.get_json())
 
     class ResponseTrainBehaviour(CyclicBehaviour):
 
@@ -155,4 +178,4 @@ class InterfaceAgent(agent.Agent):
                     resp.body = f"{currency} - {model}"
                 resp.type = response.Type.TRAIN
                 self.agent.log.debug(resp)
-                await self.agent.receiver.send(resp.get_json())
+                await self.agent.gateway.reply(message.thread, resp.get_json())
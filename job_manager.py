@@ -1,18 +1,43 @@
 import asyncio
 import itertools
-from copy import deepcopy
-from dataclasses import dataclass
-from typing import List
+import time
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, List, Optional, Tuple
+
+import numpy as np
 
 import tools
 
 
-@dataclass
+@dataclass(frozen=True)
 class Job:
+    """
+    Immutable job descriptor, can be shared between manager and behaviours without copying.
+    Data and result are tuples (items of data are frozen by freeze, tuples are taken as they are).
+    """
+    __slots__ = ('job_id', 'worker_id', 'data', 'result')
     job_id: int
-    worker_id: str
-    data: list
-    result: list = None
+    worker_id: Optional[str]
+    data: tuple
+    result: Optional[tuple]
+
+    def with_result(self, result) -> 'Job':
+        return replace(self, result=tuple(result))
+
+
+def freeze(item):
+    """
+    Immutable version of an item of data. Tuples are passed through without copying (their items are
+    assumed to be immutable too), lists and numpy arrays are copied into tuples.
+    """
+    if isinstance(item, tuple):
+        return item
+    if isinstance(item, np.ndarray):
+        return tuple(item.tolist())
+    if isinstance(item, list):
+        return tuple(freeze(element) for element in item)
+    return item
 
 
 @dataclass
@@ -22,17 +47,30 @@ class WorkerDescriptor:
 
 
 class JobManager:
-    SAFE_MODE = True  # data is deep-copied
-
-    def __init__(self, workers=None):
+    """
+    Schedules jobs (micro-batches of data) between workers.
+
+    Workers pull jobs with next_job, so fast workers take more of them. A job that is not done
+    before its deadline is given once more to an idle worker and the first result wins.
+    Results can be awaited all at once (jobs_finished) or one by one as they come (results).
+    """
+    BATCHES_PER_WORKER = 4  # na ile zadań przypadających na workera są domyślnie dzielone dane
+    JOB_TIMEOUT = 30  # po ilu sekundach zadanie może dostać inny worker
+    MAX_COPIES = 2  # ilu workerów może jednocześnie liczyć to samo zadanie
+
+    def __init__(self, workers=None, job_timeout: float = None):
         self._workers = {worker_id: WorkerDescriptor(True, 0) for worker_id in workers} if workers is not None else {}
-        self._jobs = []
-        self._jobs_done = None
+        self.job_timeout = job_timeout if job_timeout is not None else self.JOB_TIMEOUT
+        self._reset()
 
     def _reset(self):
         self._workers = {worker_id: WorkerDescriptor(True, 0) for worker_id in self._workers}
         self._jobs = []
-        self._jobs_done = None
+        self._pending = deque()  # id zadań, których nikt jeszcze nie wziął
+        self._running = {}  # id zadania -> {worker: termin}
+        self._finished = []  # id zadań w kolejności ukończenia
+        self._results = {}  # id zadania -> wynik pierwszego workera, który je skończył
+        self._changed = None
 
     def _reset_workers_status(self):
         for worker_id in self._workers:
@@ -46,82 +84,172 @@ class JobManager:
             self._reset_workers_status()
             return list(self._workers.keys())
 
-    def _get_one_worker(self):
-        available_workers = self._available_workers()
-        worker, jobs = min(self._workers.items(),
-                           key=lambda worker_and_descriptor: worker_and_descriptor[1].assigned_jobs)
-        self._workers[worker].assigned_jobs += 1
-        return worker
-
-    async def create_jobs(self, data: list, max_jobs: int = None) -> List[Job]:
+    def _all_done(self) -> bool:
+        return len(self._finished) == len(self._jobs)
+
+    def _copyable(self, worker_id):
+        "(termin, id) zadań liczonych przez innych, które worker może liczyć równolegle, gdy się spóźnią"
+        return [(min(deadlines.values()), job_id) for job_id, deadlines in self._running.items()
+                if deadlines and worker_id not in deadlines and len(deadlines) < self.MAX_COPIES
+                and not self.is_done(job_id)]
+
+    def _take(self, worker_id) -> Optional[int]:
+        "id zadania dla workera: najpierw nieprzydzielone, potem najdłużej spóźnione liczone przez innego"
+        if worker_id not in self._available_workers():
+            return None
+        if self._pending:
+            return self._pending.popleft()
+        now = time.monotonic()
+        overdue = [(deadline, job_id) for deadline, job_id in self._copyable(worker_id) if deadline <= now]
+        return min(overdue)[1] if overdue else None
+
+    def _next_deadline(self, worker_id) -> Optional[float]:
+        """
+        :return: seconds until the worker may copy an overdue job, None if there is nothing it could take
+            (it waits until the manager is notified)
+        """
+        if not self._workers[worker_id].status:
+            return None
+        deadlines = [deadline for deadline, _ in self._copyable(worker_id)]
+        return max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+    def _release(self, job: Job):
+        deadlines = self._running.get(job.job_id, {})
+        if deadlines.pop(job.worker_id, None) is not None:
+            self._workers[job.worker_id].assigned_jobs -= 1
+        if not deadlines:
+            self._running.pop(job.job_id, None)
+
+    async def create_jobs(self, data: list, max_jobs: int = None, batch_size: int = None) -> List[Job]:
         """
         Create a list of job descriptors that can be used to run job tasks.
 
         :param data: list of data
         :param max_jobs: maximum number of jobs that data can be splitted to
+            (by default BATCHES_PER_WORKER jobs per worker)
+        :param batch_size: size of data of every job, used instead of max_jobs if given
         :return: list of job descriptors
         """
         if self._jobs:
             raise Exception('Cannot create jobs, jobs already created')
 
-        workers = self._available_workers()
-        nworkers = len(workers)
-        max_jobs = nworkers if max_jobs is None else max_jobs
-        njobs = min(max(max_jobs, 1), nworkers)
-        chunks = tools.split_into_chunks(data, njobs)
+        if batch_size is not None:
+            chunks = [data[i:i + batch_size] for i in range(0, len(data), max(batch_size, 1))]
+        else:
+            max_jobs = max(len(self._workers), 1) * self.BATCHES_PER_WORKER if max_jobs is None else max_jobs
+            chunks = tools.split_into_chunks(data, max(max_jobs, 1))
         not_empty_chunks = list(filter(None, chunks))
 
-        for i, chunk in enumerate(not_empty_chunks):
-            worker = self._get_one_worker()
-            job = Job(i, worker, data=chunk, result=[])
-            self._jobs.append(job)
+        self._jobs = [Job(i, None, freeze(chunk), None) for i, chunk in enumerate(not_empty_chunks)]
+        self._pending = deque(range(len(self._jobs)))
+        self._changed = asyncio.Condition()
+        return list(self._jobs)
 
-        if self._jobs_done is None:
-            self._jobs_done = asyncio.Semaphore(value=0)
+    async def next_job(self, worker_id: str) -> Optional[Job]:
+        """
+        Wait for a job for the worker. Not assigned jobs are given first, then jobs
+        running on other workers for longer than job_timeout.
 
-        if self.SAFE_MODE:
-            return deepcopy(self._jobs)
-        else:
-            return self._jobs
+        :param worker_id: worker asking for a job
+        :return: job descriptor or None if all jobs are done
+        """
+        if worker_id not in self._workers:
+            raise ValueError('Worker {} not found in JobManager'.format(worker_id))
+
+        while self._jobs and not self._all_done():
+            job_id = self._take(worker_id)
+            if job_id is not None:
+                self._running.setdefault(job_id, {})[worker_id] = time.monotonic() + self.job_timeout
+                self._workers[worker_id].assigned_jobs += 1
+                if self._jobs[job_id].worker_id is None:
+                    self._jobs[job_id] = replace(self._jobs[job_id], worker_id=worker_id)
+                return replace(self._jobs[job_id], worker_id=worker_id)
+
+            changed = self._changed
+            async with changed:
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=self._next_deadline(worker_id))
+                except asyncio.TimeoutError:
+                    pass
+        return None
+
+    def is_done(self, job_id: int) -> bool:
+        return job_id in self._results
+
+    async def wait_done(self, job_id: int):
+        """
+        Wait until the job is done by any worker.
+        """
+        changed = self._changed
+        async with changed:
+            await changed.wait_for(lambda: not self._jobs or self.is_done(job_id))
 
-    async def job_done(self, job: Job):
+    async def job_done(self, job: Job) -> bool:
         """
         Notify manager that job has been done.
 
-        :param job: job that has been finished
+        :param job: job that has been finished, with result (see Job.with_result)
+        :return: True if it is the first result of the job (the one that is used)
         """
         if not self._jobs:
-            raise Exception('Jobs not created!')
+            return False  # wyniki zostały już zebrane, to spóźniony duplikat
 
-        self._jobs[job.job_id] = job
-        self._workers[job.worker_id].assigned_jobs -= 1
+        self._release(job)
         self._workers[job.worker_id].status = True
-
-        self._jobs_done.release()
-
-    async def job_failed(self, job: Job) -> Job:
+        first = not self.is_done(job.job_id)
+        if first:
+            self._results[job.job_id] = job.result
+            self._finished.append(job.job_id)
+        async with self._changed:
+            self._changed.notify_all()
+        return first
+
+    async def job_failed(self, job: Job):
         """
-        Notify manager that job failed and receive a new job descriptor (with a changed worker_id).
+        Notify manager that job failed. The worker is not given new jobs while other workers
+        are available, the job goes back to the front of the queue (unless it is still running elsewhere).
 
         :param job: job_descriptor of the job that failed
-        :return: job descriptor with a new worker assigned
         """
         if not self._jobs:
-            raise Exception('Jobs not created!')
+            return  # wyniki zostały już zebrane, to spóźniony duplikat
 
         if job.worker_id not in self._workers:
             msg = 'Worker {} not found in JobManager (was worker_id of a job modified?)'.format(job.worker_id)
             raise ValueError(msg)
 
-        self._workers[job.worker_id].assigned_jobs -= 1
+        self._release(job)
         self._workers[job.worker_id].status = False
-        new_worker = self._get_one_worker()
+        if not self.is_done(job.job_id) and job.job_id not in self._running:
+            self._pending.appendleft(job.job_id)
+        async with self._changed:
+            self._changed.notify_all()
 
-        self._jobs[job.job_id].worker_id = new_worker
-        if self.SAFE_MODE:
-            return deepcopy(self._jobs[job.job_id])
-        else:
-            return self._jobs[job.job_id]
+    async def job_cancelled(self, job: Job):
+        """
+        Notify manager that worker stopped computing the job, because it was done by another worker.
+        """
+        if self._jobs:
+            self._release(job)
+
+    async def results(self) -> AsyncIterator[Tuple[int, list]]:
+        """
+        Iterate over results of jobs in the order they are finished.
+
+        :return: async iterator of (job_id, result)
+        """
+        if not self._jobs:
+            raise Exception('Jobs not created!')
+
+        njobs, finished, results, changed = len(self._jobs), self._finished, self._results, self._changed
+        yielded = 0
+        while yielded < njobs:
+            async with changed:
+                await changed.wait_for(lambda: len(finished) > yielded)
+            while yielded < len(finished):
+                job_id = finished[yielded]
+                yielded += 1
+                yield job_id, results[job_id]
 
     async def jobs_finished(self) -> List:
         """
@@ -132,10 +260,13 @@ class JobManager:
         if not self._jobs:
             raise Exception('Jobs not created!')
 
-        for _ in range(len(self._jobs)):
-            await self._jobs_done.acquire()
+        async with self._changed:
+            await self._changed.wait_for(self._all_done)
 
-        results = list(itertools.chain(*(job.result for job in self._jobs)))
+        results = list(itertools.chain(*(self._results[job.job_id] for job in self._jobs)))
+        changed = self._changed
         self._reset()
+        async with changed:
+            changed.notify_all()
 
         return results
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import time
+from typing import Iterable
+
+import aiohttp
+
+import config
+
+
+class RateLimiter:
+    """
+    Token bucket allowing at most `rate` requests per second (with bursts up to `burst`).
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class MarketDataClient:
+    """
+    Long-lived CryptoCompare client.
+
+    Keeps one pooled keep-alive HTTP session, enforces the requests-per-second budget
+    and coalesces identical requests in flight, so simultaneous asks share one HTTP call.
+    """
+
+    def __init__(self, base_url: str = None, api_key: str = None, requests_per_second: float = None,
+                 connections: int = None):
+        self.base_url = base_url if base_url is not None else config.API_URL
+        self.api_key = api_key if api_key is not None else config.API_KEY
+        self.limiter = RateLimiter(requests_per_second if requests_per_second is not None else config.API_RATE_LIMIT)
+        self.connections = connections if connections is not None else config.API_CONNECTIONS
+        self.session = None
+        self.requests_sent = 0
+        self.requests_coalesced = 0
+        self._in_flight = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get_json(self, path: str, **params) -> dict:
+        """
+        Sends GET request to the API (or joins identical request already in flight).
+
+        :param path: path of the endpoint, for example /data/price
+        :param params: query parameters (None values are skipped)
+        :return: decoded json response
+        """
+        params = {name: str(value) for name, value in params.items() if value is not None}
+        key = (path, tuple(sorted(params.items())))
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(path, params))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.requests_coalesced += 1
+        # shield - anulowanie jednego z oczekujących nie anuluje zapytania pozostałym
+        return await asyncio.shield(task)
+
+    async def _fetch(self, path: str, params: dict) -> dict:
+        await self.limiter.acquire()
+        self.requests_sent += 1
+        if self.api_key:
+            params = dict(params, api_key=self.api_key)
+        async with self._get_session().get(self.base_url + path, params=params) as response:
+            return json.loads(await response.text())
+
+    async def histoday(self, fsym: str, tsym: str, limit: int, to_ts: int = None) -> dict:
+        return await self.get_json('/data/v2/histoday', fsym=fsym, tsym=tsym, toTs=to_ts, limit=limit)
+
+    async def price(self, fsym: str, tsyms: str) -> dict:
+        return await self.get_json('/data/price', fsym=fsym, tsyms=tsyms)
+
+    async def pricemulti(self, fsyms: Iterable[str], tsyms: Iterable[str]) -> dict:
+        return await self.get_json('/data/pricemulti', fsyms=','.join(sorted(set(fsyms))),
+                                   tsyms=','.join(sorted(set(tsyms))))
+
+
+class PriceCache:
+    """
+    Current prices per (fsym, tsym) with a TTL and stale-while-revalidate.
+
+    Fresh prices are served from memory, stale ones (younger than stale_ttl) are served
+    immediately while a refresh runs in the background. Symbols asked for recently are
+    watched and refresh_watched updates all of them with one pricemulti call.
+    """
+
+    def __init__(self, client: MarketDataClient, ttl: float = None, stale_ttl: float = None,
+                 watch_ttl: float = None):
+        self.client = client
+        self.ttl = ttl if ttl is not None else config.PRICE_TTL
+        self.stale_ttl = stale_ttl if stale_ttl is not None else config.PRICE_STALE_TTL
+        self.watch_ttl = watch_ttl if watch_ttl is not None else config.PRICE_WATCH_TTL
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._prices = {}  # (fsym, tsym) -> (cena, czas pobrania)
+        self._watched = {}  # (fsym, tsym) -> czas ostatniego zapytania
+        self._refreshing = set()
+
+    async def get(self, fsym: str, tsym: str):
+        """
+        :return: current price of fsym in tsym (or None if API does not know the pair)
+        """
+        key = (fsym, tsym)
+        now = time.monotonic()
+        self._watched[key] = now
+        price, fetched = self._prices.get(key, (None, None))
+        if fetched is not None and now - fetched < self.ttl:
+            self.hits += 1
+            return price
+        if fetched is not None and now - fetched < self.stale_ttl:
+            self.stale_hits += 1
+            if key not in self._refreshing:
+                self._refreshing.add(key)
+                asyncio.ensure_future(self._refresh_in_background(key))
+            return price
+
+        self.misses += 1
+        await self.refresh([key])
+        return self._prices.get(key, (None, None))[0]
+
+    async def _refresh_in_background(self, key):
+        try:
+            await self.refresh([key])
+        except aiohttp.ClientError:
+            pass
+        finally:
+            self._refreshing.discard(key)
+
+    async def refresh(self, keys):
+        """
+        Updates prices of given (fsym, tsym) pairs with a single pricemulti request.
+        """
+        keys = list(keys)
+        if not keys:
+            return
+        data = await self.client.pricemulti((fsym for fsym, _ in keys), (tsym for _, tsym in keys))
+        now = time.monotonic()
+        for fsym, tsym in keys:
+            prices = data.get(fsym)
+            price = prices.get(tsym) if isinstance(prices, dict) else None
+            if price is not None:
+                self._prices[(fsym, tsym)] = (price, now)
+
+    async def refresh_watched(self):
+        """
+        Refreshes all pairs asked for within watch_ttl, forgets the others.
+        """
+        now = time.monotonic()
+        for key, asked in list(self._watched.items()):
+            if now - asked > self.watch_ttl:
+                del self._watched[key]
+        await self.refresh(self._watched)
+
+    def stats(self) -> dict:
+        return dict(hits=self.hits, stale_hits=self.stale_hits, misses=self.misses, watched=len(self._watched))
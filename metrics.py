@@ -0,0 +1,208 @@
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+
+import config
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LABELS = ('agent', 'behaviour', 'template')
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of instrumented behaviours, labelled by agent, behaviour class and template.
+    Agents may run in different threads, so updates are guarded by a lock.
+    """
+    HISTOGRAMS = {
+        'spade_behaviour_run_seconds': 'Time spent in run, without waiting in receive',
+        'spade_behaviour_mailbox_wait_seconds': 'Time from message arrival to its receive',
+        'spade_behaviour_handling_seconds': 'Time of handling a request outside of run (see MetricsRegistry.handling)',
+    }
+    COUNTERS = {
+        'spade_behaviour_messages_received_total': 'Messages that arrived to the mailbox',
+        'spade_behaviour_messages_sent_total': 'Messages sent',
+        'spade_behaviour_received_bytes_total': 'Payload bytes of messages that arrived to the mailbox',
+        'spade_behaviour_sent_bytes_total': 'Payload bytes of messages sent',
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {name: {} for name in self.HISTOGRAMS}  # nazwa -> etykiety -> Histogram
+        self._counters = {name: {} for name in self.COUNTERS}  # nazwa -> etykiety -> wartość
+        self._behaviours = weakref.WeakKeyDictionary()  # zachowanie -> etykiety, do głębokości skrzynek
+
+    def observe(self, name: str, labels: tuple, value: float):
+        with self._lock:
+            histograms = self._histograms[name]
+            if labels not in histograms:
+                histograms[labels] = Histogram()
+            histograms[labels].observe(value)
+
+    def inc(self, name: str, labels: tuple, value: float = 1):
+        with self._lock:
+            counters = self._counters[name]
+            counters[labels] = counters.get(labels, 0) + value
+
+    def instrument(self, agent):
+        """
+        Instruments all behaviours of the agent, including the ones added later.
+
+        :param agent: spade agent (does nothing if config.METRICS is off or agent is already instrumented)
+        :return: the agent
+        """
+        if not config.METRICS or getattr(agent, 'metrics', None) is not None:
+            return agent
+
+        add_behaviour = agent.add_behaviour
+
+        def instrumented_add_behaviour(behaviour, template=None):
+            self.instrument_behaviour(behaviour, str(agent.jid), template)
+            return add_behaviour(behaviour, template)
+
+        agent.metrics = self
+        agent.add_behaviour = instrumented_add_behaviour
+        for behaviour in agent.behaviours:
+            self.instrument_behaviour(behaviour, str(agent.jid), behaviour.template)
+        return agent
+
+    def instrument_behaviour(self, behaviour, agent_name: str, template=None):
+        """
+        Wraps run, receive, send and enqueue of the behaviour (instance attributes, the class is not changed).
+        """
+        labels = (agent_name, type(behaviour).__name__, describe_template(template))
+        with self._lock:
+            if behaviour in self._behaviours:
+                return
+            self._behaviours[behaviour] = labels
+        run, receive, send, enqueue = behaviour.run, behaviour.receive, behaviour.send, behaviour.enqueue
+        arrivals = deque()  # czasy nadejścia wiadomości w kolejności skrzynki
+        waiting = [0.0]  # czas spędzony w receive podczas bieżącego run
+
+        async def timed_run():
+            waiting[0] = 0.0
+            start = time.perf_counter()
+            try:
+                return await run()
+            finally:
+                busy = time.perf_counter() - start - waiting[0]
+                self.observe('spade_behaviour_run_seconds', labels, max(busy, 0.0))
+
+        async def timed_receive(timeout=None):
+            start = time.perf_counter()
+            message = await receive(timeout)
+            waiting[0] += time.perf_counter() - start
+            if message is not None and arrivals:
+                self.observe('spade_behaviour_mailbox_wait_seconds', labels, time.monotonic() - arrivals.popleft())
+            return message
+
+        async def timed_send(message):
+            self.inc('spade_behaviour_messages_sent_total', labels)
+            self.inc('spade_behaviour_sent_bytes_total', labels, payload_size(message))
+            return await send(message)
+
+        async def timed_enqueue(message):
+            arrivals.append(time.monotonic())
+            self.inc('spade_behaviour_messages_received_total', labels)
+            self.inc('spade_behaviour_received_bytes_total', labels, payload_size(message))
+            return await enqueue(message)
+
+        behaviour.run, behaviour.receive, behaviour.send, behaviour.enqueue = \
+            timed_run, timed_receive, timed_send, timed_enqueue
+
+    @asynccontextmanager
+    async def handling(self, behaviour):
+        """
+        Measures handling of a request in a task spawned by the behaviour (not counted in its run time).
+
+        Example:
+            async with metrics.registry.handling(self):
+                await self._reply(message)
+        """
+        labels = self._behaviours.get(behaviour)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if labels is not None:
+                self.observe('spade_behaviour_handling_seconds', labels, time.perf_counter() - start)
+
+    def expose(self) -> str:
+        """
+        :return: all metrics in Prometheus text format
+        """
+        lines = []
+        with self._lock:
+            for name, help in self.HISTOGRAMS.items():
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+                for labels, histogram in self._histograms[name].items():
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{format_labels(labels, le=bound)} {count}')
+                    lines.append(f'{name}_bucket{format_labels(labels, le="+Inf")} {histogram.count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+            for name, help in self.COUNTERS.items():
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} counter']
+                for labels, value in self._counters[name].items():
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+            behaviours = list(self._behaviours.items())
+
+        name = 'spade_behaviour_mailbox_depth'
+        lines += [f'# HELP {name} Messages waiting in the mailbox', f'# TYPE {name} gauge']
+        depths = {}
+        for behaviour, labels in behaviours:
+            depths[labels] = depths.get(labels, 0) + behaviour.mailbox_size()
+        for labels, depth in depths.items():
+            lines.append(f'{name}{format_labels(labels)} {depth}')
+        return '\n'.join(lines) + '\n'
+
+
+def describe_template(template) -> str:
+    "opis szablonu do etykiety: tylko metadane, bez wątku (inaczej każda rozmowa byłaby osobną serią)"
+    metadata = getattr(template, 'metadata', None) or {}
+    return ','.join(f'{key}={value}' for key, value in sorted(metadata.items()))
+
+
+def payload_size(message) -> int:
+    body = message.body
+    return len(body.encode()) if isinstance(body, str) else len(body or b'')
+
+
+def format_labels(labels: tuple, **extra) -> str:
+    pairs = list(zip(LABELS, labels)) + list(extra.items())
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in pairs) + '}'
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+def instrument(agent):
+    return registry.instrument(agent)
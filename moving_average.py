@@ -0,0 +1,76 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import tools
+
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+
+
+def calculate_moving_average(length, records):
+    moving_average = pd.Series(records).rolling(window=length).mean().iloc[length - 1:].values
+    moving_average = np.insert(moving_average, 0, [0] * (length - 1))
+    return moving_average
+
+
+class MovingAverageCache:
+    """
+    Bounded LRU store of moving averages keyed by (series fingerprint, window length).
+
+    Stored arrays are read-only, so they can be shared between callers without copying.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._nbytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, length: int, records, key: str = None) -> np.ndarray:
+        """
+        Returns moving average of records, computing it only if it is not stored yet.
+
+        :param length: window length
+        :param records: series of prices
+        :param key: fingerprint of records (computed with tools.fingerprint if not given)
+        :return: moving average, same as calculate_moving_average(length, records)
+        """
+        key = (tools.fingerprint(records) if key is None else key, int(length))
+        moving_average = self._entries.get(key)
+        if moving_average is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return moving_average
+
+        self.misses += 1
+        moving_average = calculate_moving_average(int(length), records)
+        moving_average.setflags(write=False)
+        if moving_average.nbytes <= self.max_bytes:
+            self._entries[key] = moving_average
+            self._nbytes += moving_average.nbytes
+            self._evict()
+        return moving_average
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes:
+            _, moving_average = self._entries.popitem(last=False)
+            self._nbytes -= moving_average.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+
+    def stats(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self._entries), bytes=self._nbytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+"cache used when caller does not provide its own"
+default_cache = MovingAverageCache()
@@ -0,0 +1,186 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, List, Tuple
+
+import numpy as np
+
+import config
+
+Evaluate = Callable[[List[List[int]]], Awaitable[List[float]]]
+
+
+class Island:
+    """
+    Sub-population of IslandOptimizer.
+    """
+
+    def __init__(self, rng: np.random.Generator):
+        self.rng = rng
+        self.inbox = []  # (genotypy, koszty) migrantów z poprzedniej wyspy
+        self.best = None
+        self.best_cost = -np.inf
+        self.generations = 0
+
+    def update_best(self, population: np.ndarray, costs: np.ndarray) -> bool:
+        """
+        :return: True if the island found a better genotype
+        """
+        i = int(np.argmax(costs))
+        if costs[i] > self.best_cost:
+            self.best, self.best_cost = (int(population[i, 0]), int(population[i, 1])), float(costs[i])
+            return True
+        return False
+
+
+class IslandOptimizer:
+    """
+    Island-model genetic algorithm searching (short_mean, long_mean) with the highest cost function.
+
+    Islands evolve concurrently and do not wait for each other, so while one island selects,
+    the costs of the others are being computed. Every migration_interval generations the best
+    genotypes of an island (with their costs) move to the next island of the ring.
+    An island stops after `patience` generations without improvement.
+    Parameters not given are taken from config.
+    """
+
+    def __init__(self, evaluate: Evaluate, short_range: Tuple[int, int] = None, long_range: Tuple[int, int] = None,
+                 islands: int = None, population_size: int = None, generations: int = None,
+                 mutation_rate: float = None, mutation_step: int = None, crossover_rate: float = None,
+                 migration_interval: int = None, migrants: int = None, patience: int = None, seed: int = None,
+                 log=None):
+        """
+        :param evaluate: coroutine function computing costs of a list of [short_mean, long_mean] genotypes
+        """
+        self.evaluate = evaluate
+        self.short_range = short_range if short_range is not None else config.GA_SHORT_RANGE
+        self.long_range = long_range if long_range is not None else config.GA_LONG_RANGE
+        self.islands = islands if islands is not None else config.GA_ISLANDS
+        self.population_size = population_size if population_size is not None else config.GA_POPULATION
+        self.generations = generations if generations is not None else config.GA_GENERATIONS
+        self.mutation_rate = mutation_rate if mutation_rate is not None else config.GA_MUTATION_RATE
+        self.mutation_step = mutation_step if mutation_step is not None else config.GA_MUTATION_STEP
+        self.crossover_rate = crossover_rate if crossover_rate is not None else config.GA_CROSSOVER_RATE
+        self.migration_interval = migration_interval if migration_interval is not None \
+            else config.GA_MIGRATION_INTERVAL
+        self.migrants = migrants if migrants is not None else config.GA_MIGRANTS
+        self.patience = patience if patience is not None else config.GA_PATIENCE
+        self.seed = seed if seed is not None else config.GA_SEED
+        self.log = log
+        self.low = np.array([self.short_range[0], self.long_range[0]])
+        self.high = np.array([self.short_range[1], self.long_range[1]])
+        if self.islands < 1 or self.population_size < 2:
+            raise ValueError('At least one island with population of two is needed')
+
+    async def run(self) -> Tuple[Tuple[int, int], float]:
+        """
+        :return: best (short_mean, long_mean) found and its cost
+        """
+        seeds = np.random.SeedSequence(self.seed).spawn(self.islands)
+        islands = [Island(np.random.default_rng(seed)) for seed in seeds]
+        await asyncio.gather(*(self._evolve(i, islands) for i in range(len(islands))))
+        best = max(islands, key=lambda island: island.best_cost)
+        return best.best, best.best_cost
+
+    async def _evaluate(self, population: np.ndarray) -> np.ndarray:
+        return np.asarray(await self.evaluate(population.tolist()), dtype=np.float64)
+
+    async def _evolve(self, index: int, islands: List[Island]):
+        island = islands[index]
+        population = island.rng.integers(self.low, self.high + 1, size=(self.population_size, 2))
+        costs = await self._evaluate(population)
+        island.update_best(population, costs)
+
+        stale = 0
+        for generation in range(1, self.generations + 1):
+            children = self._offspring(island.rng, population, costs)
+            population, costs = self._select(np.concatenate([population, children]),
+                                             np.concatenate([costs, await self._evaluate(children)]))
+
+            if len(islands) > 1 and generation % self.migration_interval == 0:
+                order = np.argsort(costs, kind='stable')[::-1][:self.migrants]
+                islands[(index + 1) % len(islands)].inbox.append((population[order], costs[order]))
+            if island.inbox:
+                population = np.concatenate([population] + [genotypes for genotypes, _ in island.inbox])
+                costs = np.concatenate([costs] + [migrant_costs for _, migrant_costs in island.inbox])
+                island.inbox = []
+                population, costs = self._select(population, costs)
+
+            island.generations = generation
+            stale = 0 if island.update_best(population, costs) else stale + 1
+            if self.log is not None:
+                self.log.debug(f'Island {index}, generation {generation}: best {island.best} ({island.best_cost})')
+            if stale >= self.patience:
+                break
+
+    def _offspring(self, rng: np.random.Generator, population: np.ndarray, costs: np.ndarray) -> np.ndarray:
+        "turniejowy wybór rodziców, krzyżowanie przez wymianę długiej średniej i mutacja o losowy krok"
+        n = len(population)
+
+        def tournament():
+            a, b = rng.integers(n, size=(2, n))
+            return population[np.where(costs[a] >= costs[b], a, b)]
+
+        children = tournament().copy()
+        crossed = rng.random(n) < self.crossover_rate
+        children[crossed, 1] = tournament()[crossed, 1]
+        mutated = rng.random(children.shape) < self.mutation_rate
+        children += np.where(mutated, rng.integers(-self.mutation_step, self.mutation_step + 1, children.shape), 0)
+        return np.clip(children, self.low, self.high)
+
+    def _select(self, population: np.ndarray, costs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        "najlepsze population_size różnych genotypów (rodzice i dzieci razem)"
+        _, unique = np.unique(population, axis=0, return_index=True)
+        order = unique[np.argsort(costs[unique], kind='stable')[::-1]][:self.population_size]
+        if len(order) < self.population_size:
+            # za mało różnych genotypów, uzupełnienie powtórzeniami najlepszego
+            order = np.concatenate([order, np.repeat(order[:1], self.population_size - len(order))])
+        return population[order], costs[order]
+
+
+@dataclass
+class GridResult:
+    best: Tuple[int, int]
+    cost: float
+    short_windows: np.ndarray
+    long_windows: np.ndarray
+    surface: np.ndarray  # surface[i, j] - koszt (short_windows[i], long_windows[j])
+
+
+class GridSearch:
+    """
+    Exhaustive search of (short_mean, long_mean) pairs.
+
+    Every pair of the grid is scored exactly (the same values as cost_function gives),
+    the grid is sent to evaluate in chunks which run concurrently.
+    Gives deterministic global optimum of the grid and the whole 2-D cost surface.
+    """
+
+    def __init__(self, evaluate: Evaluate, short_windows: Iterable[int] = None, long_windows: Iterable[int] = None,
+                 chunk_size: int = None):
+        """
+        :param evaluate: coroutine function computing costs of a list of [short_mean, long_mean] genotypes
+        :param short_windows: lengths of short average, by default config.GRID_SHORT_WINDOWS or whole GA_SHORT_RANGE
+        :param long_windows: lengths of long average, by default config.GRID_LONG_WINDOWS or whole GA_LONG_RANGE
+        """
+        if short_windows is None:
+            short_windows = config.GRID_SHORT_WINDOWS or range(config.GA_SHORT_RANGE[0], config.GA_SHORT_RANGE[1] + 1)
+        if long_windows is None:
+            long_windows = config.GRID_LONG_WINDOWS or range(config.GA_LONG_RANGE[0], config.GA_LONG_RANGE[1] + 1)
+        self.evaluate = evaluate
+        self.short_windows = np.unique(np.asarray(list(short_windows), dtype=np.int64))
+        self.long_windows = np.unique(np.asarray(list(long_windows), dtype=np.int64))
+        self.chunk_size = chunk_size if chunk_size is not None else config.GRID_CHUNK
+        if not len(self.short_windows) or not len(self.long_windows):
+            raise ValueError('Grid is empty')
+
+    async def run(self) -> GridResult:
+        shorts, longs = np.meshgrid(self.short_windows, self.long_windows, indexing='ij')
+        pairs = np.stack([shorts.ravel(), longs.ravel()], axis=1).tolist()
+        chunks = [pairs[i:i + self.chunk_size] for i in range(0, len(pairs), self.chunk_size)]
+        costs = await asyncio.gather(*(self.evaluate(chunk) for chunk in chunks))
+        surface = np.concatenate([np.asarray(chunk_costs, dtype=np.float64) for chunk_costs in costs])
+        surface = surface.reshape(shorts.shape)
+
+        i, j = np.unravel_index(int(np.argmax(surface)), surface.shape)
+        return GridResult(best=(int(self.short_windows[i]), int(self.long_windows[j])), cost=float(surface[i, j]),
+                          short_windows=self.short_windows, long_windows=self.long_windows, surface=surface)
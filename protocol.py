@@ -42,6 +42,9 @@ give_negative_decision_template = make_template(performative='reply', what='deci
 "decision not available"
 give_decision_not_available_template = make_template(performative='reply', what='decision', answer='not available')
 
+"strategy agent answers decisions, earlier decisions (of its model and data) are no longer valid"
+strategy_ready_template = make_template(performative='inform', what='strategy ready')
+
 "request model from data agent"
 request_model_from_db_template = make_template(performative='request', what='model')
 
@@ -58,6 +61,12 @@ give_data_template = make_template(performative='reply', what='data')
 #
 request_cost_computation = make_template(performative='request', what='cost function')
 
+"worker does not hold training data with digest from cost request, asks for it in the same conversation"
+request_training_data = make_template(performative='please', what='training data')
+
+"training data for worker, body is packed with tools.pack_floats, 'records' metadata holds its digest"
+give_training_data = make_template(performative='inform', what='training data')
+
 please_retransfer = make_template(performative='please', what='retransfer cost function')
 
 reply_historical_data = make_template(performative='reply', what='historical data')
@@ -5,11 +5,13 @@ import requests
 import json
 import database.builder as builder
 from database.models import Record, Model
+from database.store import RecordStore
 
 "Epoch time dla lat 2014-2019, gdzie pierwszy element to 31.12.2014"
 YEARS = [1419984000, 1451520000, 1483142400, 1514678400, 1546214400, 1577750400]
 
 session = builder.Session()
+http = requests.Session()  # jedna sesja dla wszystkich zapytań (keep-alive)
 
 
 def _retrieve_information(data: dict):
@@ -44,20 +46,18 @@ def _get_historical_data(fcurr: str, tcurr: str, limit: int, timestamp: int = No
     else:
         url = f"https://min-api.cryptocompare.com/data/v2/histoday?fsym={fcurr}&tsym={tcurr}&limit={limit}&api_key={config.API_KEY}"
     print(url)
-    with requests.Session() as session:
-        response = session.get(url)
-        data = json.loads(response.text)
-        info = _retrieve_information(data)
-        return _create_records(fcurr, info)
+    response = http.get(url)
+    data = json.loads(response.text)
+    info = _retrieve_information(data)
+    return _create_records(fcurr, info)
 
 
 def get_current_data(fcurr: str, tcurr: str) -> float:
     "Pobiera aktualny kurs waluty"
     url = f"https://min-api.cryptocompare.com/data/price?fsym={fcurr}&tsyms={tcurr}"
-    with requests.Session() as session:
-        response = session.get(url)
-        data = json.loads(response.text)
-        return data[tcurr]
+    response = http.get(url)
+    data = json.loads(response.text)
+    return data[tcurr]
 
 
 def get_yearly_currency_data(fcurr: str, tcurr: str, years: iter) -> iter:
@@ -68,8 +68,21 @@ def get_yearly_currency_data(fcurr: str, tcurr: str, years: iter) -> iter:
 
 
 def save_data(data: iter):
-    session.add_all(data)
-    session.commit()
+    "Zapisuje rekordy, istniejace (ta sama waluta i czas) sa aktualizowane; zwraca (dodane, zaktualizowane)"
+    return RecordStore().upsert(data)
+
+
+def backfill(currencies: iter, tcurr: str = "PLN", years: iter = YEARS):
+    "Pobiera i zapisuje dane historyczne z podanych lat dla wielu walut, mozna wywolywac wielokrotnie"
+    store = RecordStore()
+    limit = 364
+    for fcurr in currencies:
+        rows = []
+        for timestamp in years:
+            url = f"https://min-api.cryptocompare.com/data/v2/histoday?fsym={fcurr}&tsym={tcurr}&toTs={timestamp}&limit={limit}&api_key={config.API_KEY}"
+            rows.extend(_retrieve_information(json.loads(http.get(url).text)))
+        inserted, updated = store.bulk_upsert(fcurr, rows)
+        print(f"{fcurr}: dodano {inserted}, zaktualizowano {updated}")
 
 
 def get_currency_with_models() -> iter:
@@ -94,9 +107,9 @@ def load_2019_BTC_data():
     save_data(btc_info)
 
 
-def get_currency_info(currency):
-    records = session.query(Record).filter(Record.currency == currency).order_by(Record.time).all()
-    print(records)
+def get_currency_info(currency, start=None, end=None):
+    times, closes = RecordStore().get_range(currency, start, end, columns=("time", "close"))
+    print(list(zip(times, closes)))
 
 
 def update_model():
@@ -1,39 +1,104 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
 import jsonpickle
 import numpy as np
 from aioxmpp import PresenceShow
 from spade import agent
-from spade.behaviour import OneShotBehaviour, CyclicBehaviour
+from spade.behaviour import OneShotBehaviour, CyclicBehaviour, PeriodicBehaviour
 from spade.template import Template
 
 import config
+import metrics
 import tools
 from config import domain
+from cost_backend import ProcessPoolCostBackend, XmppCostBackend
 from data_agent import DataAgent
 from database.models import Model
-from decision import decision
-from job_manager import JobManager
+from decision import CrossoverState
+from optimizer import IslandOptimizer, GridSearch
 from protocol import give_negative_decision_template, request_model_from_db_template, give_model_template, \
-    save_model_to_db_template, give_data_template, reply_historical_data, give_decision_not_available_template
-from protocol import request_decision_template, give_positive_decision_template, request_cost_computation
-from strategy_worker_agent import StrategyAgentWorker
+    save_model_to_db_template, give_data_template, reply_historical_data, give_decision_not_available_template, \
+    strategy_ready_template
+from protocol import request_decision_template, give_positive_decision_template
+from strategy_worker_agent import training_series, TRAINING_START
 from tools import make_logger, message_from_template
 
 
 class StrategyAgent(agent.Agent):
-    def __init__(self, jid, password, currency_symbol, verify_security=False):
+    def __init__(self, jid, password, currency_symbol, verify_security=False, decision_agent_jid=None):
         super().__init__(jid, password, verify_security)
         self.currency_symbol = currency_symbol
+        self.decision_agent_jid = decision_agent_jid
         self.log = make_logger(self.jid)
         self.training_behaviour = None
         self.has_strategy = False
         self.model = None
-        self.decision_records = None
+        self.decision_records = None  # ostatnie kursy zamknięcia (deque ograniczona do decision_days())
+        self.last_close_time = None  # czas ostatniego kursu w decision_records
+        self.crossover = None
+        self.training_records = None
+        self.training_records_ready = None
+        self.workers = {}  # jid -> agent StrategyAgentWorker uruchomiony przez backend xmpp
+        metrics.instrument(self)
+
+    def current_decision(self) -> bool:
+        """
+        Gives decision of the current model, rebuilding crossover state only when the model has changed.
+        """
+        short_mean, long_mean = self.model.short_mean, self.model.long_mean
+        if self.crossover is None or not self.crossover.matches(short_mean, long_mean):
+            self.crossover = CrossoverState(short_mean, long_mean, self.decision_records)
+        return self.crossover.decision
+
+    @staticmethod
+    def decision_days() -> int:
+        return max(config.DECISION_DAYS, config.GA_LONG_RANGE[1])
+
+    def add_close(self, close):
+        """
+        Appends new close price to decision records (dropping the oldest one) and updates crossover state in O(1).
+        """
+        self.decision_records.append(close)
+        if self.crossover is not None:
+            self.crossover.update(close)
+
+    def announce_ready(self):
+        """
+        Tells decision agent (if known) that decisions can be asked for and that the ones given earlier are stale.
+        Called whenever model or decision records change, the announcement is sent only when both are there.
+        """
+        if self.decision_agent_jid is not None and self.has_strategy and self.decision_records is not None:
+            self.add_behaviour(self.AnnounceReadyBehaviour())
+
+    async def get_training_records(self) -> np.ndarray:
+        """
+        Retrieves training records from Data Agent (only once per agent).
+        """
+        if self.training_records_ready is None:
+            self.training_records_ready = asyncio.Event()
+            thread = tools.make_uuid()
+            self.add_behaviour(self.RetrieveTrainingDataBehaviour(thread),
+                               Template(thread=thread, metadata=reply_historical_data.metadata))
+        await asyncio.wait_for(self.training_records_ready.wait(), timeout=config.timeout)
+        return self.training_records
+
+    async def _async_stop(self):
+        "razem z agentem zatrzymywani są jego workerzy, inaczej zostaliby po wyrzuceniu agenta z puli"
+        await super()._async_stop()
+        for worker in list(self.workers.values()):
+            await worker.stop()
+        self.workers.clear()
 
     async def setup(self):
         self.log.debug('Starting!')
         self.training_behaviour = self.TrainBehaviour()
         self.add_behaviour(self.PrepareModelBehaviour(), give_model_template)
-        self.add_behaviour(self.PrepareDataBehaviour(), reply_historical_data)
+        data_thread = tools.make_uuid()
+        self.add_behaviour(self.PrepareDataBehaviour(data_thread),
+                           Template(thread=data_thread, metadata=reply_historical_data.metadata))
 
     class PrepareModelBehaviour(OneShotBehaviour):
 
@@ -51,44 +116,39 @@ class StrategyAgent(agent.Agent):
                 self.agent.log.debug("Retrieved model from db")
                 self.agent.model = model
                 self.agent.has_strategy = True
+                self.agent.announce_ready()
 
     class TrainBehaviour(OneShotBehaviour):
         def __init__(self, *args, **kwargs):
             super(StrategyAgent.TrainBehaviour, self).__init__()
-            self.workers = []
-            self.job_manager = None
+            self.backend = None
+            self.fitness = {}  # (short_mean, long_mean) -> koszt dla bieżących danych treningowych
+            self.grid = None  # wynik przeszukania siatki (optimizer.GridResult) w trybie "grid"
 
         async def on_start(self):
-            self.workers = [f'strategy_agent_worker_{self.agent.currency_symbol}_1@{domain}' for _ in range(2)]
-            self.job_manager = JobManager(workers=self.workers)
-            for worker_jid in self.workers:
-                await StrategyAgentWorker(worker_jid, worker_jid, self.agent.currency_symbol).start(auto_register=True)
+            records = await self.agent.get_training_records()
+            if config.COST_BACKEND == 'pool':
+                self.backend = ProcessPoolCostBackend(records, max_workers=config.POOL_WORKERS)
+            else:
+                self.backend = XmppCostBackend(self.agent, records, nworkers=config.XMPP_WORKERS)
+            await self.backend.start()
+
+        async def on_end(self):
+            if self.backend is not None:
+                await self.backend.stop()
 
         async def run(self):
             self.agent.log.debug('Starting training!')
+            self.fitness = {}
+
+            if config.TRAINING_MODE == 'grid':
+                self.grid = await GridSearch(self.compute_costs).run()
+                best, cost = self.grid.best, self.grid.cost
+            else:
+                optimizer = IslandOptimizer(self.compute_costs, log=self.agent.log)
+                best, cost = await optimizer.run()
+            self.agent.log.debug(f'Best genotype {best} with cost {cost}, {len(self.fitness)} genotypes scored')
 
-            population_size = 6
-            mutation_chance = 0.05
-            niterations = 20
-            random_genotype = lambda: np.array([np.random.randint(10, 30), np.random.randint(100, 300)])
-            repair = lambda genes: np.where(genes < 1, 1, genes)
-            _mutate = lambda genes: genes + np.random.randint(-1, 2, size=(2,))
-            mutate = lambda genes: repair(_mutate(genes))
-
-            population = [random_genotype() for _ in range(population_size)]
-            for i in range(niterations):
-                self.agent.log.debug(f'Starting iteration {i}')
-                population.extend([
-                    mutate(genotype) if np.random.random() > mutation_chance
-                    else genotype
-                    for genotype in population
-                ])
-                costs = await self.compute_costs(population)
-                population = [genotype for (genotype, cost) in
-                              sorted(zip(population, costs), key=lambda x: x[1], reverse=True)]
-                population = population[:population_size]
-
-            best = population[0]
             model = Model(currency=self.agent.currency_symbol, short_mean=best[0], long_mean=best[1])
             self.agent.model = model
 
@@ -99,44 +159,22 @@ class StrategyAgent(agent.Agent):
 
             self.agent.has_strategy = True
             self.agent.log.debug('Training done!')
+            self.agent.announce_ready()
 
         async def compute_costs(self, population):
-            jobs = await self.job_manager.create_jobs(data=population)
-            for job in jobs:
-                uuid = tools.make_uuid()
-                template = Template(thread=uuid)
-                self.agent.add_behaviour(StrategyAgent.WorkerConversationBehaviour(job, uuid), template)
-
-            return await self.job_manager.jobs_finished()
-
-    class WorkerConversationBehaviour(OneShotBehaviour):
-        ATTEMPTS = 2
-
-        def __init__(self, job, uuid, *args, **kwargs):
-            super(StrategyAgent.WorkerConversationBehaviour, self).__init__()
-            self.job = job
-            self.conversation_id = uuid
+            """
+            Computes costs of genotypes, sending to workers only the ones not scored yet in this training.
 
-        async def on_start(self):
-            pass
-
-        async def run(self):
-            while True:
-                for attempt in range(self.ATTEMPTS):
-                    msg = message_from_template(request_cost_computation,
-                                                body=jsonpickle.dumps(self.job.data),
-                                                to=self.job.worker_id,
-                                                thread=self.conversation_id)
-                    await self.send(msg)
-                    reply = await self.receive(timeout=config.timeout)
-                    if reply:
-                        self.job.result = jsonpickle.loads(reply.body)
-                        self.agent.log.debug('Reply from worker {} arrived: {}'.format(reply.sender, self.job.result))
-                        await self.agent.training_behaviour.job_manager.job_done(self.job)
-                        return
-                else:
-                    self.agent.log.error('Reply from worker {} not arrived!'.format(self.job.worker_id))
-                    self.job = await self.agent.training_behaviour.job_manager.job_failed(self.job)
+            :param population: list of (short_mean, long_mean) genotypes
+            :return: list of costs in the order of population
+            """
+            keys = [(int(genotype[0]), int(genotype[1])) for genotype in population]
+            unseen = list(dict.fromkeys(key for key in keys if key not in self.fitness))
+            if unseen:
+                costs = await self.backend.compute_costs(unseen)  # krotki - JobManager ich nie kopiuje
+                self.fitness.update(zip(unseen, costs))
+            self.agent.log.debug(f'Computed {len(unseen)} new costs, {len(keys) - len(unseen)} taken from cache')
+            return [self.fitness[key] for key in keys]
 
     class GiveDecisionBehaviour(CyclicBehaviour):
         async def on_start(self):
@@ -148,33 +186,111 @@ class StrategyAgent(agent.Agent):
                 self.agent.log.debug('I got request_decision_template message!')
                 if self.agent.has_strategy:
                     # jest wytrenowany model, odsyłamy decyzję
-                    if decision(self.agent.model.short_mean, self.agent.model.long_mean, self.agent.decision_records):
-                        reply = message_from_template(give_positive_decision_template, to=str(msg.sender))
+                    if self.agent.current_decision():
+                        reply = message_from_template(give_positive_decision_template, to=str(msg.sender),
+                                                      thread=msg.thread)
                         self.agent.log.debug('I sent give_positive_decision_template message!')
                     else:
-                        reply = message_from_template(give_negative_decision_template, to=str(msg.sender))
+                        reply = message_from_template(give_negative_decision_template, to=str(msg.sender),
+                                                      thread=msg.thread)
                         self.agent.log.debug('I sent give_negative_decision_template message!')
                     await self.send(reply)
                 else:
                     # trwa trening, nie można dać decyzji
-                    reply = message_from_template(give_decision_not_available_template, to=str(msg.sender))
+                    reply = message_from_template(give_decision_not_available_template, to=str(msg.sender),
+                                                  thread=msg.thread)
                     await self.send(reply)
                     self.agent.log.debug('I sent give_decision_not_available_template message!')
 
     class PrepareDataBehaviour(OneShotBehaviour):
+        def __init__(self, thread):
+            super().__init__()
+            self.thread = thread
+
         async def run(self):
             msg = tools.create_message(to="data_agent@127.0.0.1",
                                        performative="inform", ontology="history",
                                        body=jsonpickle.encode(
-                                           value=(self.agent.currency_symbol, 300)))  # jeśli dane z ostatnich dni
+                                           value=(self.agent.currency_symbol, self.agent.decision_days())))
+            msg.thread = self.thread
+            msg.set_metadata('accept-encoding', ','.join(tools.ACCEPTED_ENCODINGS))
+            msg.set_metadata('columns', ','.join(tools.CLOSE_COLUMNS))
 
             await self.send(msg)
             reply = await self.receive(10)
-            records = jsonpickle.loads(reply.body)
-            # print(records)
-            self.agent.decision_records = list(map(lambda x: x.close, records))
+            records = tools.decode_history(reply)
+            order = np.argsort(records['time'], kind='stable')
+            self.agent.decision_records = deque(records['close'][order].tolist(), maxlen=self.agent.decision_days())
+            self.agent.last_close_time = int(records['time'][order][-1]) if len(order) else None
             self.agent.add_behaviour(StrategyAgent.GiveDecisionBehaviour(), request_decision_template)
-            # print(self.agent.decision_records)
+            self.agent.announce_ready()
+
+            refresh_thread = tools.make_uuid()
+            start_at = datetime.now() + timedelta(seconds=config.DECISION_REFRESH)
+            self.agent.add_behaviour(StrategyAgent.NewClosesBehaviour(refresh_thread, period=config.DECISION_REFRESH,
+                                                                      start_at=start_at),
+                                     Template(thread=refresh_thread, metadata=reply_historical_data.metadata))
+
+    class NewClosesBehaviour(PeriodicBehaviour):
+        """
+        Fetches closes newer than the last one in decision records and feeds them to add_close.
+        """
+        DAY = 86400
+
+        def __init__(self, thread, period, start_at=None):
+            super().__init__(period=period, start_at=start_at)
+            self.thread = thread
+
+        async def run(self):
+            since = self.agent.last_close_time
+            days = self.agent.decision_days() if since is None else max(2, (int(time.time()) - since) // self.DAY + 1)
+            msg = tools.create_message(to="data_agent@127.0.0.1", performative="inform", ontology="history",
+                                       body=jsonpickle.encode(value=(self.agent.currency_symbol, days, since)),
+                                       thread=self.thread)
+            msg.set_metadata('accept-encoding', ','.join(tools.ACCEPTED_ENCODINGS))
+            msg.set_metadata('columns', ','.join(tools.CLOSE_COLUMNS))
+            await self.send(msg)
+            reply = await self.receive(config.timeout)
+            if reply is None:
+                self.agent.log.error('New closes not arrived!')
+                return
+
+            records = tools.decode_history(reply)
+            order = np.argsort(records['time'], kind='stable')
+            added = 0
+            for close_time, close in zip(records['time'][order].tolist(), records['close'][order].tolist()):
+                if since is None or close_time > since:
+                    self.agent.add_close(close)
+                    self.agent.last_close_time = since = close_time
+                    added += 1
+            if added:
+                self.agent.log.debug(f'Added {added} new closes')
+                self.agent.announce_ready()
+
+    class AnnounceReadyBehaviour(OneShotBehaviour):
+        async def run(self):
+            await self.send(message_from_template(strategy_ready_template, to=self.agent.decision_agent_jid))
+
+    class RetrieveTrainingDataBehaviour(OneShotBehaviour):
+        def __init__(self, thread):
+            super().__init__()
+            self.thread = thread
+
+        async def run(self):
+            msg = tools.create_message(to="data_agent@127.0.0.1",
+                                       performative="inform", ontology="history",
+                                       body=jsonpickle.encode(value=(self.agent.currency_symbol, None, TRAINING_START)))
+            msg.thread = self.thread
+            msg.set_metadata('accept-encoding', ','.join(tools.ACCEPTED_ENCODINGS))
+            msg.set_metadata('columns', ','.join(tools.CLOSE_COLUMNS))
+            await self.send(msg)
+            reply = await self.receive(config.timeout)
+            if reply is not None:
+                self.agent.training_records = training_series(tools.decode_history(reply))
+                self.agent.log.debug(f'Retrieved {len(self.agent.training_records)} training records')
+                self.agent.training_records_ready.set()
+            else:
+                self.agent.log.error('Training data not arrived!')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from typing import List
+
+import config
+from strategy_agent import StrategyAgent
+
+
+class StrategyAgentPool:
+    """
+    Lifecycle of strategy agents run by decision agent.
+
+    Agents are started on demand or in advance (prewarm), the time of last use of every agent
+    is remembered and agents idle for longer than idle_ttl can be stopped to keep memory bounded.
+    """
+
+    def __init__(self, decision_agent_jid: str, idle_ttl: float = None, concurrency: int = None,
+                 log: logging.Logger = None):
+        self.decision_agent_jid = decision_agent_jid
+        self.idle_ttl = idle_ttl if idle_ttl is not None else config.STRATEGY_IDLE_TTL
+        self.concurrency = concurrency if concurrency is not None else config.PREWARM_CONCURRENCY
+        self.agents = {}  # waluta -> agent strategii
+        self.last_used = {}  # waluta -> czas ostatniego użycia
+        self.log = log if log is not None else logging.getLogger(__name__)  # zwykle log agenta decyzyjnego
+
+    def __contains__(self, currency: str) -> bool:
+        return currency in self.agents
+
+    def __len__(self) -> int:
+        return len(self.agents)
+
+    def touch(self, currency: str):
+        self.last_used[currency] = time.monotonic()
+
+    async def ensure(self, currency: str) -> bool:
+        """
+        Starts strategy agent of currency if it is not running.
+
+        :return: True if the agent was started by this call
+        """
+        self.touch(currency)
+        if currency in self.agents:
+            return False
+        jid = f'{currency}@{config.domain}'
+        strategy_agent = StrategyAgent(jid, currency, currency, decision_agent_jid=self.decision_agent_jid)
+        self.agents[currency] = strategy_agent
+        try:
+            await strategy_agent.start(auto_register=True)
+        except Exception:
+            del self.agents[currency]
+            raise
+        self.log.debug(f'Started strategy agent {jid}, {len(self.agents)} running')
+        return True
+
+    async def prewarm(self, currencies) -> List[str]:
+        """
+        Starts agents of given currencies, at most `concurrency` registrations at a time.
+
+        :return: currencies whose agents were started
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def start(currency):
+            async with semaphore:
+                try:
+                    return await self.ensure(currency)
+                except Exception as e:
+                    self.log.error(f'Could not start strategy agent for {currency}: {e}')
+                    return False
+
+        currencies = list(dict.fromkeys(currencies))
+        started = await asyncio.gather(*(start(currency) for currency in currencies))
+        return [currency for currency, was_started in zip(currencies, started) if was_started]
+
+    def idle(self) -> List[str]:
+        """
+        :return: currencies of agents unused for longer than idle_ttl (agents during training are never idle)
+        """
+        now = time.monotonic()
+        return [currency for currency, strategy_agent in self.agents.items()
+                if now - self.last_used.get(currency, now) > self.idle_ttl and strategy_agent.has_strategy]
+
+    async def evict(self, currency: str):
+        strategy_agent = self.agents.pop(currency, None)
+        self.last_used.pop(currency, None)
+        if strategy_agent is not None:
+            await strategy_agent.stop()
+            self.log.debug(f'Stopped idle strategy agent {strategy_agent.jid}, {len(self.agents)} running')
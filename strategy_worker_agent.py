@@ -1,68 +1,110 @@
-import asyncio
+from collections import OrderedDict
 
 import jsonpickle
+import numpy as np
 from spade import agent
 from spade.behaviour import CyclicBehaviour, OneShotBehaviour
 from spade.message import Message
+from spade.template import Template
 
+import config
+import metrics
 import tools
 from config import domain
-from cost_function import cost_function
-from data_agent import DataAgent
-from protocol import request_cost_computation, reply_historical_data
+from cost_function import cost_function_batch
+from moving_average import MovingAverageCache
+from protocol import request_cost_computation, request_training_data, give_training_data
+
+"Epoch time 31.12.2017, dane treningowe są brane od tego momentu"
+TRAINING_START = 1514678400
+
+
+def training_series(columns) -> np.ndarray:
+    """
+    Extracts training close prices from historical data.
+
+    :param columns: historical data as dict of column name to array (see tools.decode_history)
+    :return: close prices after TRAINING_START, sorted by time
+    """
+    order = np.argsort(columns['time'], kind='stable')
+    return columns['close'][order][columns['time'][order] > TRAINING_START]
+
+
+def with_job(request: Message, metadata: dict) -> dict:
+    "metadane odpowiedzi z id zadania z zapytania (master po nim odrzuca spóźnione odpowiedzi)"
+    job = request.get_metadata('job')
+    return dict(metadata, job=job) if job is not None else metadata
 
 
 class StrategyAgentWorker(agent.Agent):
+    MAX_TRAINING_DATA = 4  # ile różnych zestawów danych treningowych trzyma worker
 
     def __init__(self, jid, password, currency_symbol, verify_security=False):
         super().__init__(jid, password, verify_security)
         self.currency_symbol = currency_symbol
-        self.records_ready = None
-        self.records = None
-        self.training_records = None
+        self.training_data = OrderedDict()  # digest -> ceny zamknięcia
+        self.moving_averages = MovingAverageCache()
         self.log = tools.make_logger(self.jid)
+        metrics.instrument(self)
 
     async def setup(self):
         self.log.debug('Starting!')
-        self.add_behaviour(self.RetrieveDataBehaviour(), reply_historical_data)
         self.add_behaviour(StrategyAgentWorker.MasterConversation(), request_cost_computation)
-        self.records_ready = asyncio.Semaphore(value=0)
+
+    def store_training_data(self, digest, records):
+        self.training_data[digest] = records
+        while len(self.training_data) > self.MAX_TRAINING_DATA:
+            self.training_data.popitem(last=False)
+
+    def costs_reply(self, msg: Message, records) -> Message:
+        data = jsonpickle.loads(msg.body)
+        self.log.debug('Data ready, computing cost function')
+        costs = cost_function_batch(data, records, self.moving_averages).tolist()
+        self.log.debug('Cost function computed, moving average cache: {}'.format(self.moving_averages.stats()))
+        reply = msg.make_reply()
+        reply.metadata = with_job(msg, dict(performative='reply'))
+        reply.body = tools.to_json(costs)
+        return reply
 
     class MasterConversation(CyclicBehaviour):
         async def run(self):
             msg = await self.receive(30)  # type: Message
-            await self.agent.records_ready.acquire()
             if msg:
-                data = jsonpickle.loads(msg.body)
-                self.agent.log.debug('Data ready, computing cost function')
-                costs = [cost_function(value[0], value[1], self.agent.training_records) for value in data]
-                self.agent.log.debug('Cost function computed')
-                reply = msg.make_reply()
-                reply.metadata = dict(performative='reply')
-                reply.body = tools.to_json(costs)
-                await self.send(reply)
-                self.agent.log.debug('Reply sent!')
-            self.agent.records_ready.release()
+                digest = msg.get_metadata('records')
+                records = self.agent.training_data.get(digest)
+                if records is not None:
+                    self.agent.training_data.move_to_end(digest)
+                    await self.send(self.agent.costs_reply(msg, records))
+                    self.agent.log.debug('Reply sent!')
+                else:
+                    template = Template(thread=msg.thread, metadata=give_training_data.metadata)
+                    self.agent.add_behaviour(StrategyAgentWorker.RetrieveDataBehaviour(msg), template)
 
     class RetrieveDataBehaviour(OneShotBehaviour):
-        async def run(self):
-            self.agent.log.debug('Retrieving data from Data Agent')
-            msg = tools.create_message(to="data_agent@127.0.0.1",
-                                       performative="inform", ontology="history",
-                                       body=jsonpickle.encode(value=(self.agent.currency_symbol, None))) # jeśli dane treningowe
+        def __init__(self, request: Message):
+            super().__init__()
+            self.request = request
 
+        async def run(self):
+            digest = self.request.get_metadata('records')
+            self.agent.log.debug(f'Asking master for training data {digest}')
+            msg = self.request.make_reply()
+            msg.metadata = with_job(self.request, dict(request_training_data.metadata, records=digest))
             await self.send(msg)
-            reply = await self.receive(100)
-            if reply is not None:
-                self.agent.records = jsonpickle.loads(reply.body)
-                self.agent.training_records = list(map(lambda x: x.close,
-                                                       sorted(filter(lambda x: x.time > 1514678400, self.agent.records),
-                                                              key=lambda x: x.time)))
-                self.agent.records_ready.release()
+
+            reply = await self.receive(config.timeout)
+            if reply is None:
+                self.agent.log.error(f'Training data {digest} not arrived!')
+                return
+            records = tools.unpack_floats(reply.body)
+            if tools.fingerprint(records) != digest:
+                self.agent.log.error(f'Training data does not match digest {digest}!')
+                return
+            self.agent.store_training_data(digest, records)
+            await self.send(self.agent.costs_reply(self.request, records))
+            self.agent.log.debug('Reply sent!')
 
 
 if __name__ == '__main__':
-    data_agent = DataAgent("data_agent@127.0.0.1", "data_agent")
-    data_agent.start(auto_register=False)
     agent = StrategyAgentWorker(f'strategy_agent_worker1@{domain}', 'strategy_agent_worker1', "ETH")
     agent.start(auto_register=True)
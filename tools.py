@@ -1,10 +1,15 @@
+import base64
+import hashlib
 import json
 import logging
 import sys
 import uuid
+import zlib
 from itertools import tee
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterable
 
+import jsonpickle
+import numpy as np
 from spade.message import Message
 from spade.template import Template
 
@@ -58,8 +63,8 @@ def create_template(performative: str, ontology: str) -> Template:
     return template
 
 
-def create_message(to: str, performative: str, ontology: str, body: str) -> Message:
-    message = Message(to=to)
+def create_message(to: str, performative: str, ontology: str, body: str, thread: str = None) -> Message:
+    message = Message(to=to, thread=thread)
     message.set_metadata("performative", performative)
     message.set_metadata("ontology", ontology)
     message.body = body
@@ -142,3 +147,119 @@ def split_into_chunks(alist: List, nchunks: int) -> List[List]:
             yield alist[si:ei]
 
     return list(chunks(alist, nchunks))
+
+
+def fingerprint(values) -> str:
+    """
+    Computes a content hash of a numeric series, used as a cache key for data derived from it.
+
+    :param values: sequence of numbers
+    :return: hex digest of the series converted to float64
+    """
+    array = np.ascontiguousarray(values, dtype=np.float64)
+    return hashlib.blake2b(array.tobytes(), digest_size=16).hexdigest()
+
+
+def pack_floats(values) -> str:
+    """
+    Packs a numeric series into a compact text blob (base64 of little-endian float64).
+    """
+    return base64.b64encode(np.ascontiguousarray(values, dtype='<f8').tobytes()).decode('ascii')
+
+
+def unpack_floats(blob: str) -> np.ndarray:
+    """
+    Unpacks a series packed with pack_floats.
+    """
+    return np.frombuffer(base64.b64decode(blob), dtype='<f8')
+
+
+"kolumny danych historycznych i ich typy w formacie kolumnowym"
+HISTORY_COLUMNS = {"time": "<i8", "open": "<f8", "high": "<f8", "low": "<f8", "close": "<f8"}
+
+COLUMNAR_ENCODING = "columnar"
+COMPRESSED_COLUMNAR_ENCODING = "columnar+zlib"
+
+"encodings understood by receivers of historical data, in order of preference"
+ACCEPTED_ENCODINGS = (COMPRESSED_COLUMNAR_ENCODING, COLUMNAR_ENCODING)
+
+"kolumny potrzebne do decyzji i uczenia - czytane z indeksu pokrywającego, bez tabeli"
+CLOSE_COLUMNS = ("time", "close")
+
+
+def negotiate_encoding(accepted: str) -> str:
+    """
+    Chooses payload encoding from 'accept-encoding' metadata of a request.
+
+    :param accepted: comma separated encodings accepted by the requester (or None)
+    :return: first supported encoding or None if only jsonpickle is accepted
+    """
+    for encoding in (accepted or '').split(','):
+        if encoding.strip() in ACCEPTED_ENCODINGS:
+            return encoding.strip()
+    return None
+
+
+def requested_columns(requested: str) -> Tuple[str, ...]:
+    """
+    Chooses columns of historical data from 'columns' metadata of a request.
+
+    :param requested: comma separated column names (or None for requesters not sending it)
+    :return: known columns in the requested order, time always included; all columns by default
+    """
+    names = [name.strip() for name in (requested or '').split(',') if name.strip() in HISTORY_COLUMNS]
+    if not names:
+        return tuple(HISTORY_COLUMNS)
+    return tuple(dict.fromkeys(["time"] + names))
+
+
+def records_to_columns(records: Iterable, columns: Iterable[str] = HISTORY_COLUMNS) -> Dict[str, np.ndarray]:
+    """
+    Converts records (objects with time, open, high, low and close attributes) to parallel arrays.
+    """
+    records = list(records)
+    return {name: np.array([getattr(record, name) for record in records], dtype=HISTORY_COLUMNS[name])
+            for name in columns}
+
+
+def encode_columns(columns: Dict[str, np.ndarray], encoding: str = COLUMNAR_ENCODING) -> str:
+    """
+    Encodes parallel arrays as json with base64 of packed little-endian values for every column.
+
+    :param columns: dict of column name to array
+    :param encoding: COLUMNAR_ENCODING or COMPRESSED_COLUMNAR_ENCODING
+    :return: message body
+    """
+    encoded = {}
+    for name, values in columns.items():
+        dtype = HISTORY_COLUMNS.get(name, "<f8")
+        data = np.ascontiguousarray(values, dtype=dtype).tobytes()
+        if encoding == COMPRESSED_COLUMNAR_ENCODING:
+            data = zlib.compress(data)
+        encoded[name] = [dtype, base64.b64encode(data).decode('ascii')]
+    return json.dumps(encoded)
+
+
+def decode_columns(body: str, encoding: str = COLUMNAR_ENCODING) -> Dict[str, np.ndarray]:
+    """
+    Decodes message body created with encode_columns.
+    """
+    columns = {}
+    for name, (dtype, data) in json.loads(body).items():
+        data = base64.b64decode(data)
+        if encoding == COMPRESSED_COLUMNAR_ENCODING:
+            data = zlib.decompress(data)
+        columns[name] = np.frombuffer(data, dtype=dtype)
+    return columns
+
+
+def decode_history(message: Message) -> Dict[str, np.ndarray]:
+    """
+    Decodes historical data reply of the Data Agent, whichever encoding it has chosen.
+
+    :return: dict of column name to array
+    """
+    encoding = message.get_metadata('encoding')
+    if encoding in ACCEPTED_ENCODINGS:
+        return decode_columns(message.body, encoding)
+    return records_to_columns(jsonpickle.loads(message.body))